@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the GGUF header reader in toolboxes/gguf-vram-estimator.py.
+
+Writes synthetic GGUF headers (metadata + tokenizer arrays, no tensor data)
+to a temporary directory and times the estimator's GGUFMetadataReader against
+the original read()/seek() based reader it replaced.
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import statistics
+import struct
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+ESTIMATOR_PATH = Path(__file__).resolve().parent.parent / "toolboxes" / "gguf-vram-estimator.py"
+DEFAULT_VOCABS = [32000, 150000, 256000]
+
+
+def load_estimator():
+    spec = importlib.util.spec_from_file_location("gguf_vram_estimator", ESTIMATOR_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class LegacyGGUFMetadataReader:
+    """The original per-field read()/seek() reader, kept as the baseline."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.metadata: Dict = {}
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            self.f = f
+            magic, _, _, metadata_kv_count = struct.unpack("<IIQQ", self.f.read(24))
+            self._read_metadata(metadata_kv_count)
+        return self
+
+    def _read_string(self) -> str:
+        (length,) = struct.unpack("<Q", self.f.read(8))
+        return self.f.read(length).decode("utf-8", errors="replace")
+
+    def _read_value(self, value_type_idx: int):
+        if value_type_idx == 8: return self._read_string()
+        if value_type_idx == 4: return struct.unpack("<I", self.f.read(4))[0]
+        if value_type_idx == 5: return struct.unpack("<i", self.f.read(4))[0]
+        self._skip_value(value_type_idx)
+
+    def _skip_value(self, value_type_idx: int):
+        if value_type_idx in (0, 1, 7): self.f.seek(1, 1)
+        elif value_type_idx in (2, 3): self.f.seek(2, 1)
+        elif value_type_idx in (4, 5, 6): self.f.seek(4, 1)
+        elif value_type_idx == 8:
+            (length,) = struct.unpack("<Q", self.f.read(8))
+            self.f.seek(length, 1)
+        elif value_type_idx == 9:
+            (array_type_idx, count) = struct.unpack("<IQ", self.f.read(12))
+            type_map = {0:1, 1:1, 2:2, 3:2, 4:4, 5:4, 6:4, 7:1, 10:8, 11:8, 12:8}
+            element_size = type_map.get(array_type_idx)
+            if element_size: self.f.seek(count * element_size, 1)
+            else:
+                for _ in range(count): self._skip_value(8)
+
+    def _read_metadata(self, count: int):
+        keys_to_read = {"general.architecture", "general.name"}
+        arch_specific_keys_added = False
+        for _ in range(count):
+            key = self._read_string()
+            (value_type_idx,) = struct.unpack("<I", self.f.read(4))
+            if not arch_specific_keys_added and "general.architecture" in self.metadata:
+                prefix = self.metadata["general.architecture"]
+                keys_to_read.update({
+                    f"{prefix}.block_count", f"{prefix}.context_length",
+                    f"{prefix}.attention.head_count_kv", f"{prefix}.attention.key_length",
+                    f"{prefix}.attention.value_length", f"{prefix}.attention.sliding_window_size"
+                })
+                arch_specific_keys_added = True
+            if key in keys_to_read:
+                self.metadata[key] = self._read_value(value_type_idx)
+            else:
+                self._skip_value(value_type_idx)
+
+
+def _gguf_string(s: str) -> bytes:
+    data = s.encode("utf-8")
+    return struct.pack("<Q", len(data)) + data
+
+
+def _tensor_info(name: str, shape: List[int], ggml_type: int, offset: int) -> bytes:
+    return _gguf_string(name) + struct.pack(f"<I{len(shape)}QIQ", len(shape), *shape, ggml_type, offset)
+
+
+def write_synthetic_gguf(path: Path, n_vocab: int, n_layers: int = 0, drop_keys: Tuple[str, ...] = ()) -> None:
+    """Write a llama-style GGUF header with an n_vocab tokenizer.
+
+    With n_layers > 0 it also lists the tensors of that many Q4_K blocks and
+    extends the file (sparsely) to cover their data; otherwise there are none.
+    Metadata keys in drop_keys are left out.
+    """
+    tokens = [f"tok{i}" for i in range(n_vocab)]
+    merges = [f"t{i} k{i}" for i in range(n_vocab)]
+    kv = [
+        ("general.architecture", 8, _gguf_string("llama")),
+        ("general.name", 8, _gguf_string(f"synthetic-{n_vocab}")),
+        ("general.file_type", 4, struct.pack("<I", 15)),
+        ("llama.block_count", 4, struct.pack("<I", 48)),
+        ("llama.context_length", 4, struct.pack("<I", 131072)),
+        ("llama.embedding_length", 4, struct.pack("<I", 5120)),
+        ("llama.rope.freq_base", 6, struct.pack("<f", 1e6)),
+        ("llama.attention.head_count", 4, struct.pack("<I", 40)),
+        ("llama.attention.head_count_kv", 4, struct.pack("<I", 8)),
+        ("llama.attention.key_length", 4, struct.pack("<I", 128)),
+        ("llama.attention.value_length", 4, struct.pack("<I", 128)),
+        ("llama.attention.layer_norm_rms_epsilon", 6, struct.pack("<f", 1e-5)),
+        ("tokenizer.ggml.model", 8, _gguf_string("gpt2")),
+        ("tokenizer.ggml.tokens", 9, struct.pack("<IQ", 8, n_vocab) + b"".join(map(_gguf_string, tokens))),
+        ("tokenizer.ggml.token_type", 9, struct.pack("<IQ", 5, n_vocab) + struct.pack(f"<{n_vocab}i", *([1] * n_vocab))),
+        ("tokenizer.ggml.merges", 9, struct.pack("<IQ", 8, n_vocab) + b"".join(map(_gguf_string, merges))),
+        ("tokenizer.ggml.bos_token_id", 4, struct.pack("<I", 1)),
+        ("tokenizer.chat_template", 8, _gguf_string("{{ messages }}" * 64)),
+    ]
+    kv = [entry for entry in kv if entry[0] not in drop_keys]
+    tensors = []
+    if n_layers:
+        tensors.append(("token_embd.weight", [5120, n_vocab], 14))
+        for i in range(n_layers):
+            tensors += [(f"blk.{i}.attn_{name}.weight", [5120, 5120 if name in ("q", "output") else 1024], 12) for name in ("q", "k", "v", "output")]
+            tensors += [(f"blk.{i}.ffn_{name}.weight", [13824, 5120] if name == "down" else [5120, 13824], 12) for name in ("gate", "up", "down")]
+        tensors.append(("output.weight", [5120, n_vocab], 14))
+    infos, offset = [], 0
+    for name, shape, ggml_type in tensors:
+        infos.append(_tensor_info(name, shape, ggml_type, offset))
+        n_elements = shape[0] * shape[1]
+        offset += -(-(n_elements // 256 * (210 if ggml_type == 14 else 144)) // 32) * 32
+    with open(path, "wb") as f:
+        f.write(struct.pack("<IIQQ", 0x46554747, 3, len(tensors), len(kv)))
+        for key, value_type, payload in kv:
+            f.write(_gguf_string(key) + struct.pack("<I", value_type) + payload)
+        f.write(b"".join(infos))
+        if tensors: f.truncate(-(-f.tell() // 32) * 32 + offset)
+
+
+def time_reader(reader_cls: Callable, path: Path, repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        reader_cls(str(path)).read()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the estimator's GGUF header reader on synthetic files.")
+    parser.add_argument("--vocab", nargs="+", type=int, default=DEFAULT_VOCABS, help="Vocabulary sizes to generate (default: 32000 150000 256000).")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per reader and file (default: 5).")
+    args = parser.parse_args()
+
+    estimator = load_estimator()
+    readers = [("legacy", LegacyGGUFMetadataReader), ("current", estimator.GGUFMetadataReader)]
+
+    print(f"{'Vocab':>10s} | {'Reader':>8s} | {'Median':>10s} | {'Best':>10s} | {'Speedup':>8s}")
+    print("-" * 58)
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_vocab in args.vocab:
+            path = Path(tmp) / f"synthetic-{n_vocab}.gguf"
+            write_synthetic_gguf(path, n_vocab)
+
+            expected = LegacyGGUFMetadataReader(str(path)).read().metadata
+            actual = estimator.GGUFMetadataReader(str(path)).read().metadata
+            # The current reader keeps more architecture keys; compare the shared ones.
+            actual = {key: value for key, value in actual.items() if key in expected}
+            if actual != expected:
+                print(f"Metadata mismatch for vocab {n_vocab}: {expected} != {actual}", file=sys.stderr)
+                return 1
+
+            baseline = None
+            for name, reader_cls in readers:
+                timings = time_reader(reader_cls, path, args.repeat)
+                median = statistics.median(timings)
+                baseline = baseline or median
+                print(f"{n_vocab:>10,} | {name:>8s} | {median * 1000:>7.2f} ms | {min(timings) * 1000:>7.2f} ms | {baseline / median:>7.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
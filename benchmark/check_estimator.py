@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Regression checks for toolboxes/gguf-vram-estimator.py on synthetic GGUFs.
+
+Each check writes what it needs with bench_gguf_reader.py's writer into a
+temporary directory and prints one OK / FAIL line. Exits 1 if any check fails.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+from bench_gguf_reader import load_estimator, write_synthetic_gguf
+
+
+def check_cache_entries_from_other_cwd(estimator, tmp: Path) -> Tuple[bool, str]:
+    """A model cached through a relative path is still listed, with its real path, from another directory."""
+    (tmp / "models").mkdir()
+    (tmp / "elsewhere").mkdir()
+    write_synthetic_gguf(tmp / "models" / "relative.gguf", 1000, 2)
+    cache = estimator.ModelCache(str(tmp / "cache"))
+    cwd = os.getcwd()
+    try:
+        os.chdir(tmp)
+        estimator.load_model_info(os.path.join("models", "relative.gguf"), cache)
+        os.chdir(tmp / "elsewhere")
+        entries = cache.entries()
+        hit = cache.get(str(tmp / "models" / "relative.gguf"))
+    finally:
+        os.chdir(cwd)
+    expected = os.path.realpath(tmp / "models" / "relative.gguf")
+    ok = [entry["path"] for entry in entries] == [expected] and hit is not None
+    return ok, f"entries: {[entry['path'] for entry in entries]}, cache hit by real path: {hit is not None}"
+
+
+def check_mha_without_head_count_kv(estimator, tmp: Path) -> Tuple[bool, str]:
+    """A GGUF without attention.head_count_kv (phi2, gpt2) caches K and V for every head."""
+    path = tmp / "mha.gguf"
+    write_synthetic_gguf(path, 1000, 2, drop_keys=("llama.attention.head_count_kv",))
+    metadata = estimator.load_model_info(str(path)).metadata
+    # 48 layers x 4096 cells x (K + V) x 40 heads x 128 dims x f16
+    expected = 48 * 4096 * 2 * 40 * 128 * 2
+    kv_bytes = estimator.kv_cache_bytes(metadata, 4096)
+    return kv_bytes == expected, f"KV at 4096: {kv_bytes:,} bytes (expected {expected:,})"
+
+
+CHECKS: List[Tuple[str, Callable]] = [
+    ("cache entries, other cwd", check_cache_entries_from_other_cwd),
+    ("MHA without head_count_kv", check_mha_without_head_count_kv),
+]
+
+
+def main() -> int:
+    estimator = load_estimator()
+    failures = 0
+    for label, check in CHECKS:
+        with tempfile.TemporaryDirectory() as tmp:
+            ok, detail = check(estimator, Path(tmp))
+        print(f"{label:<28s} | {'OK' if ok else 'FAIL'} | {detail}")
+        failures += not ok
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Checks that toolboxes/gguf-vram-estimator.py gives the same estimate for a
+GGUF read over HTTP as for the same file on disk.
+
+Writes synthetic GGUFs with bench_gguf_reader.py's writer, serves them from a
+local http.server (once with range requests, once without, like a plain
+`python -m http.server`) and compares the JSON of estimate() for the URL with
+the one for the local path. Exits 1 on any difference.
+"""
+
+from __future__ import annotations
+
+import argparse
+import functools
+import http.server
+import json
+import os
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+from bench_gguf_reader import load_estimator, write_synthetic_gguf
+
+DEFAULT_VOCABS = [32000, 256000]
+N_LAYERS = 8
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """SimpleHTTPRequestHandler plus single "Range: bytes=a-b" requests, as served by HuggingFace."""
+
+    def do_GET(self):
+        self.server.requests += 1
+        header = self.headers.get("Range", "")
+        if not header.startswith("bytes="): return super().do_GET()
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path): return super().do_GET()
+        size = os.path.getsize(path)
+        start, end = header[len("bytes="):].split("-")
+        start, end = int(start), min(int(end or size - 1), size - 1)
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        with open(path, "rb") as f:
+            f.seek(start)
+            self.wfile.write(f.read(end - start + 1))
+
+    def log_message(self, *args):
+        pass
+
+
+class PlainRequestHandler(http.server.SimpleHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests += 1
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+class QuietServer(http.server.ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # The estimator hangs up once it has the header; a reset while sending the rest is expected.
+        if not isinstance(sys.exc_info()[1], ConnectionError): super().handle_error(request, client_address)
+
+
+def serve(handler, directory: str) -> QuietServer:
+    server = QuietServer(("127.0.0.1", 0), functools.partial(handler, directory=directory))
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def estimate_json(estimator, path: str) -> str:
+    row = estimator.estimate(path, config=estimator.RunConfig()).to_dict()
+    row.pop("path")
+    return json.dumps(row, sort_keys=True)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare remote (HTTP) and local estimates of synthetic GGUFs.")
+    parser.add_argument("--vocab", nargs="+", type=int, default=DEFAULT_VOCABS, help="Vocabulary sizes to generate (default: 32000 256000).")
+    args = parser.parse_args()
+
+    estimator = load_estimator()
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_vocab in args.vocab:
+            write_synthetic_gguf(Path(tmp) / f"synthetic-{n_vocab}.gguf", n_vocab, N_LAYERS)
+        servers = [("range", serve(RangeRequestHandler, tmp)), ("no range", serve(PlainRequestHandler, tmp))]
+        for n_vocab in args.vocab:
+            name = f"synthetic-{n_vocab}.gguf"
+            local = estimate_json(estimator, os.path.join(tmp, name))
+            for label, server in servers:
+                before = server.requests
+                remote = estimate_json(estimator, f"http://127.0.0.1:{server.server_port}/{name}")
+                status = "OK" if remote == local else "MISMATCH"
+                print(f"{name:<28s} | {label:>8s} | {server.requests - before:>3d} request(s) | {status}")
+                if remote != local:
+                    print(f"  local:  {local}\n  remote: {remote}", file=sys.stderr)
+                    failures += 1
+        missing = f"http://127.0.0.1:{servers[0][1].server_port}/missing.gguf"
+        try:
+            estimator.estimate(missing)
+            print(f"{missing}: no error for a missing file", file=sys.stderr)
+            failures += 1
+        except FileNotFoundError as e:
+            print(f"{'missing.gguf':<28s} | {'range':>8s} | FileNotFoundError: {e}")
+        for _, server in servers:
+            server.shutdown()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Checks the ggml RPC readiness probe in run_distributed_llama.py against a
+local fake rpc-server.
+
+Each fake server answers HELLO, DEVICE_COUNT and GET_DEVICE_MEMORY like one
+llama.cpp build would: protocol 2 (one device), protocol 3 with one or two
+devices, an unsupported protocol, a server that accepts but never replies
+(wedged) and a port nobody listens on. The local version lookup runs a fake
+`toolbox` whose rpc-server answers HELLO (or exits at once). Exits 1 if any
+result differs from the expected one.
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+SCRIPT_PATH = Path(__file__).resolve().parent.parent / "run_distributed_llama.py"
+GIB = 1024**3
+PROBE_TIMEOUT = 0.5
+# `toolbox run -c <image> -- rpc-server -H 127.0.0.1 -p <port>`, serving protocol 3.1.0 with one device.
+FAKE_TOOLBOX = f"""#!{sys.executable}
+import socket, struct, sys
+port = int(sys.argv[sys.argv.index("-p") + 1])
+server = socket.create_server(("127.0.0.1", port))
+while True:
+    conn, _ = server.accept()
+    with conn:
+        while header := conn.recv(9):
+            cmd, size = struct.unpack("<BQ", header)
+            if size: conn.recv(size)
+            reply = {{14: bytes((3, 1, 0)), 15: struct.pack("<I", 1), 11: struct.pack("<QQ", 1, 2)}}[cmd]
+            conn.sendall(struct.pack("<Q", len(reply)) + reply)
+"""
+
+
+def load_runner():
+    spec = importlib.util.spec_from_file_location("run_distributed_llama", SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def fake_rpc_server(version, devices, wedged=False) -> int:
+    """Serves the ggml RPC handshake on a free local port; returns the port."""
+    server = socket.create_server(("127.0.0.1", 0))
+
+    def recv_exact(conn, n):
+        data = b""
+        while len(data) < n:
+            chunk = conn.recv(n - len(data))
+            if not chunk: raise ConnectionError
+            data += chunk
+        return data
+
+    def handle(conn):
+        with conn:
+            try:
+                while True:
+                    cmd, size = struct.unpack("<BQ", recv_exact(conn, 9))
+                    payload = recv_exact(conn, size)
+                    if wedged:
+                        time.sleep(PROBE_TIMEOUT * 4)
+                        return
+                    if cmd == 14: reply = bytes(version)
+                    elif cmd == 15: reply = struct.pack("<I", len(devices))
+                    elif cmd == 11: reply = struct.pack("<QQ", *devices[struct.unpack("<I", payload)[0] if payload else 0])
+                    else: return
+                    conn.sendall(struct.pack("<Q", len(reply)) + reply)
+            except (ConnectionError, OSError):
+                pass
+
+    def serve():
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def closed_port() -> int:
+    with socket.create_server(("127.0.0.1", 0)) as s:
+        return s.getsockname()[1]
+
+
+def main() -> int:
+    runner = load_runner()
+    cases = [
+        ("protocol 2", fake_rpc_server((2, 0, 0), [(50 * GIB, 64 * GIB)]), ("2.0.0", 50 * GIB, 64 * GIB, 1)),
+        ("protocol 3", fake_rpc_server((3, 0, 0), [(100 * GIB, 120 * GIB)]), ("3.0.0", 100 * GIB, 120 * GIB, 1)),
+        ("protocol 3, 2 devices", fake_rpc_server((3, 1, 0), [(10 * GIB, 20 * GIB), (5 * GIB, 20 * GIB)]), ("3.1.0", 15 * GIB, 40 * GIB, 2)),
+        ("unsupported", fake_rpc_server((9, 0, 0), [(GIB, GIB)]), ValueError),
+        ("wedged", fake_rpc_server((3, 0, 0), [(GIB, GIB)], wedged=True), OSError),
+        ("nothing listening", closed_port(), OSError),
+    ]
+    failures = 0
+    for label, port, expected in cases:
+        try:
+            result = runner.probe_rpc_server("127.0.0.1", port, timeout=PROBE_TIMEOUT)
+        except (OSError, ValueError) as e:
+            result = e
+        ok = isinstance(result, expected) if isinstance(expected, type) else result == expected
+        shown = f"{type(result).__name__}: {result}" if isinstance(result, Exception) else result
+        print(f"{label:<22s} | {'OK' if ok else 'FAIL'} | {shown}")
+        failures += not ok
+
+    # wait_for_rpc: a protocol error fails at once, a wedged server only at the deadline.
+    for label, port, limit in [("unsupported", cases[3][1], 0.1), ("wedged", cases[4][1], 10.0)]:
+        start = time.monotonic()
+        probe, error = runner.wait_for_rpc("127.0.0.1", port, start + PROBE_TIMEOUT)
+        elapsed = time.monotonic() - start
+        ok = probe is None and error and elapsed < limit
+        print(f"{'wait ' + label:<22s} | {'OK' if ok else 'FAIL'} | {elapsed:.2f} s: {error}")
+        failures += not ok
+
+    for server, client, expected in [("3.0.0", "3.1.0", True), ("3.2.0", "3.1.0", False), ("2.0.0", "3.0.0", False)]:
+        ok = runner.rpc_version_compatible(server, client) == expected
+        print(f"{'server ' + server + ' / ' + client:<22s} | {'OK' if ok else 'FAIL'} | compatible: {expected}")
+        failures += not ok
+
+    # local_rpc_version: asks a short-lived local rpc-server unless RPC_PROTOCOL_VERSION is set.
+    runner.RPC_PROTOCOL_VERSION = None
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["PATH"] = f"{tmp}{os.pathsep}{os.environ['PATH']}"
+        for label, script, expected in [("local version", FAKE_TOOLBOX, "3.1.0"), ("local exits", "#!/bin/sh\nexit 1\n", None)]:
+            toolbox = Path(tmp) / "toolbox"
+            toolbox.write_text(script)
+            toolbox.chmod(0o755)
+            start = time.monotonic()
+            version, error = runner.local_rpc_version("image", start + 10)
+            elapsed = time.monotonic() - start
+            ok = version == expected and (error is None) == (expected is not None) and elapsed < 5
+            print(f"{label:<22s} | {'OK' if ok else 'FAIL'} | {elapsed:.2f} s: {version or error}")
+            failures += not ok
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,6 +6,7 @@ MODEL_LIMIT=""
 START_INDEX=1
 TIMEOUT_SECS=1800
 COMMIT_PUSH=false
+ALLOC_LOG=false
 while [[ $# -gt 0 ]]; do
   case $1 in
     --limit)
@@ -36,12 +37,17 @@ while [[ $# -gt 0 ]]; do
       COMMIT_PUSH=true
       shift
       ;;
+    --alloc-log)
+      ALLOC_LOG=true
+      shift
+      ;;
     -h|--help)
-      echo "Usage: $0 [--start-index N] [--limit N] [--timeout SECS] [--commitpush]"
+      echo "Usage: $0 [--start-index N] [--limit N] [--timeout SECS] [--commitpush] [--alloc-log]"
       echo "  --start-index N  Start from model N (1-based, alphabetically sorted)"
       echo "  --limit N        Limit the number of models to benchmark"
       echo "  --timeout SECS   Max seconds per benchmark test (default: 1800)"
       echo "  --commitpush     Auto-commit and push results after completion"
+      echo "  --alloc-log      Run llama-bench with -v so logs keep the buffer sizes (for validate_estimator.py)"
       exit 0
       ;;
     *)
@@ -63,6 +69,7 @@ SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 MODEL_DIR="$SCRIPT_DIR/models"
 RESULTDIR="$SCRIPT_DIR/results"
 STATE_FILE="$SCRIPT_DIR/.benchmark_state"
+ESTIMATOR="$SCRIPT_DIR/../toolboxes/gguf-vram-estimator.py"
 mkdir -p "$RESULTDIR"
 
 # Cleanup state file on exit
@@ -368,6 +375,15 @@ write_benchmark_meta() {
 for MODEL_PATH in "${MODEL_PATHS[@]}"; do
   MODEL_NAME="$(basename "$MODEL_PATH" .gguf)"
 
+  # Verify every shard's header first: a missing or half-downloaded part would
+  # otherwise only fail at load time, once per environment.
+  if [[ -f "$ESTIMATOR" ]] && ! CHECK_OUT="$(python3 "$ESTIMATOR" --check "$MODEL_PATH" 2>&1)"; then
+    echo "$(ts) ⏩ Skipping ${MODEL_NAME}: ${CHECK_OUT}"
+    ((CURRENT_STEP += STEPS_PER_MODEL)) || true
+    ((SKIPPED_COUNT += STEPS_PER_MODEL)) || true
+    continue
+  fi
+
   for ENV in "${!CMDS[@]}"; do
     CMD="${CMDS[$ENV]}"
     mapfile -t HBLT_MODES < <(get_hblt_modes "$ENV")
@@ -422,6 +438,9 @@ for MODEL_PATH in "${MODEL_PATHS[@]}"; do
           fi
 
           FULL_CMD=( $CMD_EFFECTIVE -ngl 99 -mmp 0 -m "$MODEL_PATH" "${EXTRA_ARGS[@]}" "${CTX_ARGS[@]}" -r "$CTX_REPS" )
+          if [[ "$ALLOC_LOG" == true ]]; then
+            FULL_CMD+=( -v )
+          fi
 
           # Ensure toolbox works before running
           TOOLBOX_NAME="${TOOLBOX_NAMES[$ENV]}"
@@ -100,6 +100,12 @@ ensure_models_exist() {
   for m in "${MODELS[@]}"; do
     local resolved
     if resolved="$(resolve_model_path "$m")"; then
+      # Missing or truncated shards would otherwise only fail at load time on every env.
+      if [[ -f "$SCRIPT_DIR/../toolboxes/gguf-vram-estimator.py" ]] &&
+         ! python3 "$SCRIPT_DIR/../toolboxes/gguf-vram-estimator.py" --check "$resolved" >&2; then
+        echo "[WARN] Skipping model with bad shards: $m" >&2
+        continue
+      fi
       RESOLVED_MODELS+=("$resolved")
     else
       echo "[WARN] Missing model file: $m" >&2
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Checks toolboxes/gguf-vram-estimator.py against what llama.cpp actually allocated.
+
+Reads benchmark logs (results/ and results-rpc/ by default), finds the GGUF
+each one was run on below --models, and compares the estimator's prediction
+with the log:
+
+  * weights: the "model buffer size" lines, or the llama-bench "size" column;
+  * kv:      the "KV buffer size" / "KV self size" lines, at the log's n_ctx and K/V types;
+  * compute: the "compute buffer size" lines, at the log's n_ctx, -ub and -fa.
+
+Plain llama-bench logs only carry the model size; run the benchmarks with
+--alloc-log (llama-bench -v) or pass llama-server / llama-cli logs to get the
+KV and compute lines as well. Errors are reported per architecture, together
+with the margin that would have covered 95% of the measured runs.
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import math
+import os
+import re
+import statistics
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+BENCH_DIR = Path(__file__).resolve().parent
+ESTIMATOR_PATH = BENCH_DIR.parent / "toolboxes" / "gguf-vram-estimator.py"
+DEFAULT_LOG_DIRS = [BENCH_DIR / "results", BENCH_DIR / "results-rpc"]
+DEFAULT_MODEL_DIR = BENCH_DIR / "models"
+METRICS = ["weights", "kv", "compute"]
+
+# First data row of a llama-bench table: "| glm4moe 355B.A32B Q4_K - Medium | 189.69 GiB | ..."
+BENCH_SIZE_RE = re.compile(r"^\|[^|]+\|\s*([\d.]+)\s*GiB\s*\|", re.MULTILINE)
+
+
+def load_estimator():
+    spec = importlib.util.spec_from_file_location("gguf_vram_estimator", ESTIMATOR_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def find_logs(paths: List[Path]) -> List[Path]:
+    logs = []
+    for path in paths:
+        if path.is_dir(): logs.extend(sorted(path.rglob("*.log")))
+        elif path.is_file(): logs.append(path)
+    return logs
+
+
+def model_stem(log: Path) -> str:
+    """Benchmark logs are named <model file stem>__<env>[__...].log."""
+    return log.name.split("__")[0].removesuffix(".log")
+
+
+def compare_log(estimator, log: Path, model_path: str, model) -> List[Dict[str, Any]]:
+    """One record per metric the log lets us check."""
+    arch = model.metadata.get("general.architecture", "?")
+    alloc = estimator.parse_llama_log(str(log))
+    records = []
+
+    def add(metric: str, measured: int, estimate: int, n_ctx: Optional[int] = None):
+        records.append({"log": str(log), "model": os.path.basename(model_path), "architecture": arch,
+                        "metric": metric, "n_ctx": n_ctx, "measured": measured, "estimate": estimate,
+                        "error": (estimate - measured) / measured if measured else 0.0})
+
+    if "model_bytes" in alloc:
+        add("weights", alloc["model_bytes"], model.weight_bytes)
+    else:
+        match = BENCH_SIZE_RE.search(log.read_text(errors="replace"))
+        if match: add("weights", int(float(match.group(1)) * 1024**3), model.weight_bytes)
+    if "n_ctx" in alloc:
+        config = estimator.log_run_config(alloc, estimator.RunConfig())
+        n_ctx = alloc["n_ctx"]
+        if "kv_bytes" in alloc:
+            add("kv", alloc["kv_bytes"], estimator.kv_cache_bytes(model.metadata, n_ctx, config), n_ctx)
+        if "compute_bytes" in alloc:
+            add("compute", alloc["compute_bytes"], estimator.compute_buffer_bytes(model, n_ctx, config), n_ctx)
+    return records
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile, q in [0, 100]."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Error distribution per (architecture, metric), plus an "all" row per metric."""
+    groups: Dict[tuple, List[Dict[str, Any]]] = defaultdict(list)
+    for record in records:
+        groups[(record["architecture"], record["metric"])].append(record)
+        groups[("all", record["metric"])].append(record)
+    rows = []
+    for (arch, metric), group in sorted(groups.items(), key=lambda item: (item[0][0] == "all", item[0][0], METRICS.index(item[0][1]))):
+        errors = [r["error"] for r in group]
+        # Relative headroom to add to the estimate so that it covers the measured size.
+        shortfall = [max(0.0, r["measured"] / r["estimate"] - 1) if r["estimate"] else 0.0 for r in group]
+        rows.append({"architecture": arch, "metric": metric, "count": len(group),
+                     "mean_error": statistics.fmean(errors), "median_error": statistics.median(errors),
+                     "p90_abs_error": percentile([abs(e) for e in errors], 90),
+                     "max_abs_error": max(abs(e) for e in errors),
+                     "margin_p95": percentile(shortfall, 95)})
+    return rows
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare gguf-vram-estimator.py predictions with llama.cpp allocations in logs.")
+    parser.add_argument("logs", nargs="*", type=Path, default=DEFAULT_LOG_DIRS, help="Log files or directories (default: results/ and results-rpc/).")
+    parser.add_argument("--models", type=Path, default=DEFAULT_MODEL_DIR, help=f"Directory holding the benchmarked GGUFs (default: {DEFAULT_MODEL_DIR}).")
+    parser.add_argument("--format", choices=["table", "json"], default="table", help="Output format (default: table).")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Also list every comparison.")
+    args = parser.parse_args()
+
+    estimator = load_estimator()
+    models = {Path(path).stem: path for path in estimator.find_models(str(args.models))} if args.models.is_dir() else {}
+    cache = estimator.ModelCache()
+    loaded: Dict[str, Any] = {}
+    records, unmatched, failed = [], 0, 0
+    for log in find_logs(args.logs):
+        model_path = models.get(model_stem(log))
+        if not model_path:
+            unmatched += 1
+            continue
+        try:
+            if model_path not in loaded: loaded[model_path] = estimator.load_model_info(model_path, cache)
+            records.extend(compare_log(estimator, log, model_path, loaded[model_path]))
+        except estimator.ESTIMATE_ERRORS as e:
+            print(f"{log.name}: {e}", file=sys.stderr)
+            failed += 1
+    summary = summarize(records)
+
+    if args.format == "json":
+        print(json.dumps({"summary": summary, "records": records if args.verbose else [],
+                          "unmatched_logs": unmatched, "failed_logs": failed}, indent=2))
+        return 0
+    if args.verbose:
+        print(f"{'Log':<60s} | {'Metric':>7s} | {'Measured':>12s} | {'Estimate':>12s} | {'Error':>7s}")
+        for r in records:
+            print(f"{Path(r['log']).name[-60:]:<60s} | {r['metric']:>7s} | {estimator.format_mem(r['measured']):>12s} | "
+                  f"{estimator.format_mem(r['estimate']):>12s} | {r['error']:>+7.1%}")
+        print()
+    print(f"{'Architecture':>14s} | {'Metric':>7s} | {'Runs':>5s} | {'Mean':>7s} | {'Median':>7s} | {'P90 |e|':>7s} | {'Max |e|':>7s} | {'Margin P95':>10s}")
+    print("-" * 90)
+    for row in summary:
+        print(f"{row['architecture'][:14]:>14s} | {row['metric']:>7s} | {row['count']:>5,} | {row['mean_error']:>+7.1%} | "
+              f"{row['median_error']:>+7.1%} | {row['p90_abs_error']:>7.1%} | {row['max_abs_error']:>7.1%} | {row['margin_p95']:>+10.1%}")
+    print(f"\nError = (estimate - measured) / measured. Margin P95 = headroom on the estimate that covers 95% of runs.")
+    if unmatched: print(f"{unmatched} log(s) skipped: no matching GGUF below {args.models}.")
+    if failed: print(f"{failed} log(s) skipped: model could not be read.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,21 @@
 #!/usr/bin/env python3
 import sys
 import os
+import json
+import shlex
 import shutil
+import socket
+import struct
 import tempfile
 import subprocess
 import time
 import signal
+import textwrap
+import threading
+import importlib.util
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # --- Configuration & Defaults ---
@@ -32,6 +42,52 @@ DEFAULT_HOSTS = [
 REMOTE_PORT = os.getenv("REMOTE_PORT", "22")
 RPC_PORT = os.getenv("RPC_PORT", "50052")
 LOCAL_HOST_PORT = "8080"
+# Overall deadline (seconds) for every RPC server to accept connections.
+RPC_READY_TIMEOUT = float(os.getenv("RPC_READY_TIMEOUT", "60"))
+# ggml-rpc wire protocol: requests are a command byte, a u64 payload size and the payload;
+# replies are a u64 size and the payload. HELLO must be the first command on a connection.
+RPC_CMD_GET_DEVICE_MEMORY = 11
+RPC_CMD_HELLO = 14
+RPC_CMD_DEVICE_COUNT = 15  # protocol 3+: rpc-server can expose several devices
+RPC_SUPPORTED_MAJOR = (2, 3)
+# Per-request timeout (seconds) of the readiness probe; a server that accepts but never replies is wedged.
+RPC_PROBE_TIMEOUT = float(os.getenv("RPC_PROBE_TIMEOUT", "5"))
+# Protocol version of the local llama.cpp build (e.g. "3.0.0") that every server must be compatible with.
+# Unset: asked from a short-lived local rpc-server in the same toolbox; "off" skips the check.
+RPC_PROTOCOL_VERSION = os.getenv("RPC_PROTOCOL_VERSION")
+# Pool mode: "<pid> <toolbox> <image id> <port>" of the rpc-server kept running between runs.
+POOL_TAG_FILE = "/tmp/rpc-server-pool.tag"
+# rpc-server -c keeps received tensors (>= 10 MiB) here, one file per FNV-1a hash of the data.
+RPC_CACHE_DIR = '"${LLAMA_CACHE:-${XDG_CACHE_HOME:-$HOME/.cache}/llama.cpp}/rpc"'
+RPC_CACHE_FILE = re.compile(r"^[0-9a-f]{16}$")
+# Which model each node's cache files came from, learned by diffing the caches around each run.
+CACHE_MANIFEST = Path(os.getenv("XDG_CACHE_HOME", Path.home() / ".cache")) / "strix-halo-distributed" / "rpc-cache-manifest.json"
+# Arguments that make llama-bench load the model (pushing every tensor to the nodes) and do almost nothing else.
+CACHE_SEED_ARGS = ["-p", "0", "-n", "1", "-r", "1"]
+# llama.cpp flags in extra_args that change the split plan (alias -> name); llama-bench takes comma lists.
+PLAN_FLAGS = {
+    "-np": "n_parallel", "--parallel": "n_parallel", "-b": "n_batch", "--batch-size": "n_batch",
+    "-ub": "n_ubatch", "--ubatch-size": "n_ubatch", "-ctk": "cache_type_k", "--cache-type-k": "cache_type_k",
+    "-ctv": "cache_type_v", "--cache-type-v": "cache_type_v", "-fa": "flash_attn", "--flash-attn": "flash_attn",
+    "-c": "n_ctx", "--ctx-size": "n_ctx", "-p": "n_prompt", "--n-prompt": "n_prompt", "-n": "n_gen", "--n-gen": "n_gen",
+}
+# An explicit split in extra_args replaces the planned one.
+TENSOR_SPLIT_FLAGS = ("-ts", "--tensor-split")
+# How long (seconds) an idle multiplexed SSH master connection stays up after the run.
+SSH_CONTROL_PERSIST = os.getenv("SSH_CONTROL_PERSIST", "60")
+
+ESTIMATOR_PATH = SCRIPT_DIR / "toolboxes" / "gguf-vram-estimator.py"
+
+# Prints the free GPU-addressable memory (VRAM + GTT) of the first amdgpu device, in bytes.
+FREE_MEMORY_QUERY = """
+for d in /sys/class/drm/card*/device; do
+    if [ -r "$d/mem_info_gtt_total" ]; then
+        echo $(( $(cat $d/mem_info_vram_total) - $(cat $d/mem_info_vram_used) + $(cat $d/mem_info_gtt_total) - $(cat $d/mem_info_gtt_used) ))
+        exit 0
+    fi
+done
+exit 1
+"""
 
 
 # --- Helper Functions ---
@@ -55,6 +111,488 @@ def run_dialog(args):
 def show_msg(title, msg):
     run_dialog(["--title", title, "--msgbox", msg, "10", "60"])
 
+def load_estimator():
+    spec = importlib.util.spec_from_file_location("gguf_vram_estimator", ESTIMATOR_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class SSHSessions:
+    """One persistent, multiplexed SSH connection (ControlMaster) per host.
+
+    connect() pays the handshake once; run() sends every later command
+    (start, health checks, log tails, cleanup) over that connection and
+    records its latency for summary(). Without a master, run() falls back
+    to a plain ssh connection.
+    """
+
+    def __init__(self):
+        self.control_dir = tempfile.mkdtemp(prefix="llama-ssh-")
+        self.setup = {}  # ip -> (seconds, error or None)
+        self.latency = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def _ssh(self, ip, master="no"):
+        return ["ssh", "-p", REMOTE_PORT, "-o", f"ControlMaster={master}",
+                "-o", f"ControlPath={self.control_dir}/%C", ip]
+
+    def connect(self, ip):
+        """Opens the master connection for ip; returns None or an error message."""
+        start = time.monotonic()
+        # The backgrounded master keeps its stderr open, so it goes to a file rather than a pipe.
+        with tempfile.TemporaryFile(mode="w+") as err:
+            res = subprocess.run(
+                self._ssh(ip, master="yes")[:-1] + ["-o", f"ControlPersist={SSH_CONTROL_PERSIST}", "-f", "-N", ip],
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=err
+            )
+            err.seek(0)
+            error = None if res.returncode == 0 else f"SSH connection failed: {err.read().strip()}"
+        with self.lock:
+            self.setup[ip] = (time.monotonic() - start, error)
+        return error
+
+    def run(self, ip, command, input=None):
+        start = time.monotonic()
+        # Without input, ssh must not read (and swallow) our own stdin.
+        stdin = {"input": input} if input is not None else {"stdin": subprocess.DEVNULL}
+        res = subprocess.run(self._ssh(ip) + [command], text=True, capture_output=True, **stdin)
+        with self.lock:
+            self.latency[ip].append(time.monotonic() - start)
+        return res
+
+    def close(self):
+        for ip in self.setup:
+            subprocess.run(self._ssh(ip)[:-1] + ["-O", "exit", ip], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(self.control_dir, ignore_errors=True)
+
+    def summary(self, ips):
+        print("SSH sessions:")
+        for ip in ips:
+            if ip not in self.setup: continue
+            seconds, error = self.setup[ip]
+            times = self.latency.get(ip, [])
+            commands = (f"{len(times)} command(s), mean {1000 * sum(times) / len(times):.0f} ms, max {1000 * max(times):.0f} ms"
+                        if times else "no commands")
+            print(f"   {ip:<18} connect {1000 * seconds:5.0f} ms  {commands}" + (f"  [ERROR] {error}" if error else ""))
+
+def query_free_memory(sessions=None, ip=None):
+    """Free VRAM + GTT in bytes on a remote host (or locally when ip is None), None if unknown."""
+    if ip:
+        res = sessions.run(ip, "bash -s", input=FREE_MEMORY_QUERY)
+    else:
+        res = subprocess.run(["bash", "-s"], input=FREE_MEMORY_QUERY, text=True, capture_output=True)
+    value = res.stdout.strip()
+    return int(value) if res.returncode == 0 and value.isdigit() else None
+
+def extra_arg_values(args, flags):
+    """{name: value} of the last `--flag value` / `--flag=value` in args for each flag in flags (alias -> name)."""
+    values = {}
+    for i, arg in enumerate(args):
+        flag, eq, value = arg.partition("=")
+        if flag in flags:
+            values[flags[flag]] = value if eq else (args[i + 1] if i + 1 < len(args) else "")
+    return values
+
+def planned_run(state, estimator, model):
+    """(RunConfig, n_ctx) of the llama.cpp process the run will launch, from its mode and extra_args."""
+    values = extra_arg_values(state.extra_args, PLAN_FLAGS)
+    largest = lambda name, default: max(int(x) for x in values[name].split(",")) if name in values else default
+    overrides = {name: largest(name, None) for name in ("n_parallel", "n_batch", "n_ubatch") if name in values}
+    overrides.update({name: values[name].split(",")[0] for name in ("cache_type_k", "cache_type_v") if name in values})
+    if "flash_attn" in values:
+        overrides["flash_attn"] = any(x.lower() not in ("0", "off", "false") for x in values["flash_attn"].split(","))
+    if any(arg in ("-kvu", "--kv-unified") for arg in state.extra_args): overrides["kv_unified"] = True
+    if state.mode == "llama-bench":
+        # llama-bench allocates -p + -n tokens per test (512 + 128 by default), never the training context.
+        n_ctx = largest("n_prompt", 512) + largest("n_gen", 128)
+    else:
+        # extra_args come last on the command line, so their -c wins; without any, the model's training context.
+        n_ctx = largest("n_ctx", 0) or state.context_size or estimator.training_context(model.metadata)
+    return estimator.RunConfig(**overrides), n_ctx
+
+def plan_tensor_split(state, active_ips, sessions, probes=None):
+    """Prints a per-node memory plan and returns the --tensor-split value, or None to keep llama.cpp's default.
+
+    The plan uses the context, -np, KV types and batch sizes the launched
+    process gets from its mode and extra_args; an explicit -ts there wins.
+    Remote free memory comes from the RPC handshake probes when given (what the
+    backend itself reports), else from sysfs over SSH.
+    """
+    if any(arg.partition("=")[0] in TENSOR_SPLIT_FLAGS for arg in state.extra_args):
+        print("Using the tensor split given in the extra arguments.")
+        return None
+    names = active_ips + ["local"]
+    if probes and any(probe[3] != 1 for probe in probes.values()):
+        print("[WARN] A host exposes several RPC devices; using llama.cpp's default split.")
+        return None
+    with ThreadPoolExecutor(max_workers=len(names)) as pool:
+        free = list(pool.map(lambda ip: probes[ip][1] if probes and ip in probes else query_free_memory(sessions, ip), active_ips + [None]))
+    missing = [name for name, size in zip(names, free) if not size]
+    if missing:
+        print(f"[WARN] Could not read free memory on {', '.join(missing)}; using llama.cpp's default split.")
+        return None
+    try:
+        estimator = load_estimator()
+        model = estimator.load_model_info(state.model_path, estimator.ModelCache())
+        config, n_ctx = planned_run(state, estimator, model)
+        loads = estimator.plan_tensor_split(model, list(zip(names, free)), n_ctx, config)
+    except Exception as e:
+        print(f"[WARN] Split planning failed ({e}); using llama.cpp's default split.")
+        return None
+    estimator.print_tensor_split(loads, n_ctx)
+    return estimator.tensor_split_arg(loads)
+
+def rpc_server_script(ip, image, pool=False):
+    """Bash script (fed to `ssh ip bash -s`) that restarts rpc-server in the background and prints "started <PID>".
+
+    With pool=True a running server whose tag (toolbox, the toolbox's image ID,
+    i.e. its llama.cpp build, and port) matches is kept, and "reused <PID>" is
+    printed instead; a restarted server is tagged for the next run.
+    """
+    # We assume 'toolbox' command exists on remote
+    if not pool:
+        return f"""
+    set -euo pipefail
+    pkill -9 -f rpc-server || true
+    rm -f {POOL_TAG_FILE}
+    nohup toolbox run -c {image} -- rpc-server -H 0.0.0.0 -p {RPC_PORT} -c > /tmp/rpc-server-{ip}.log 2>&1 < /dev/null &
+    echo "started $!"
+    """
+    return f"""
+    set -euo pipefail
+    want="{image} $(podman container inspect --format '{{{{.Image}}}}' {image} 2>/dev/null || echo unknown) {RPC_PORT}"
+    if read -r pid have < {POOL_TAG_FILE} 2>/dev/null && [ "$have" = "$want" ] && grep -qs rpc-server /proc/$pid/cmdline; then
+        echo "reused $pid"
+        exit 0
+    fi
+    pkill -9 -f rpc-server || true
+    nohup toolbox run -c {image} -- rpc-server -H 0.0.0.0 -p {RPC_PORT} -c > /tmp/rpc-server-{ip}.log 2>&1 < /dev/null &
+    echo "$! $want" > {POOL_TAG_FILE}
+    echo "started $!"
+    """
+
+def rpc_stop_script(pid=None):
+    """Bash script (fed to `ssh ip bash -s`) that kills rpc-server (and pid) and drops the pool tag.
+
+    It must go over stdin: sshd runs a command line through `$SHELL -c`, whose
+    own command line would then match the pkill pattern and be killed with it.
+    """
+    return f"""
+    {f"kill -9 {pid} 2>/dev/null || true" if pid else ""}
+    pkill -9 -f rpc-server || true
+    rm -f {POOL_TAG_FILE}
+    """
+
+def start_rpc_server(ip, image, sessions, pool=False):
+    """Starts (or in pool mode reuses) rpc-server on ip over SSH; returns (pid, error, reused)."""
+    res = sessions.run(ip, "bash -s", input=rpc_server_script(ip, image, pool))
+    if res.returncode != 0:
+        return None, f"SSH failed: {res.stderr.strip()}", False
+    lines = res.stdout.strip().splitlines()
+    status, _, pid = lines[-1].partition(" ") if lines else ("", "", "")
+    if status not in ("started", "reused") or not pid.isdigit():
+        return None, f"Invalid PID returned: {res.stdout.strip()}", False
+    return pid, None, status == "reused"
+
+def stop_rpc_servers(active_ips, sessions):
+    """Stops the (pooled) rpc-server on every host; returns the hosts that could not be reached."""
+    if not active_ips: return []
+    def stop(ip):
+        return sessions.connect(ip) or sessions.run(ip, "bash -s", input=rpc_stop_script()).returncode
+    with ThreadPoolExecutor(max_workers=len(active_ips)) as pool:
+        return [ip for ip, failed in zip(active_ips, pool.map(stop, active_ips)) if failed]
+
+def _recv_exact(sock, n):
+    data = bytearray()
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk: raise ConnectionError("connection closed by rpc-server")
+        data += chunk
+    return bytes(data)
+
+def _rpc_call(sock, cmd, payload=b""):
+    sock.sendall(struct.pack("<BQ", cmd, len(payload)) + payload)
+    (size,) = struct.unpack("<Q", _recv_exact(sock, 8))
+    return _recv_exact(sock, size)
+
+def probe_rpc_server(ip, port, timeout=RPC_PROBE_TIMEOUT):
+    """Runs the ggml RPC handshake against ip:port: HELLO, then GET_DEVICE_MEMORY for every device.
+
+    Returns (version, free bytes, total bytes, device count). Raises OSError
+    if the server is unreachable or does not answer (wedged), ValueError if it
+    speaks a protocol version this probe does not know.
+    """
+    with socket.create_connection((ip, int(port)), timeout=timeout) as sock:
+        hello = _rpc_call(sock, RPC_CMD_HELLO)
+        if len(hello) != 3: raise ValueError(f"unexpected {len(hello)}-byte HELLO reply; not an rpc-server?")
+        major, minor, patch = hello
+        version = f"{major}.{minor}.{patch}"
+        if major not in RPC_SUPPORTED_MAJOR: raise ValueError(f"unsupported RPC protocol {version}")
+        try:
+            if major >= 3:
+                (n_devices,) = struct.unpack("<I", _rpc_call(sock, RPC_CMD_DEVICE_COUNT))
+                memory = [struct.unpack("<QQ", _rpc_call(sock, RPC_CMD_GET_DEVICE_MEMORY, struct.pack("<I", device)))
+                          for device in range(n_devices)]
+            else:
+                n_devices, memory = 1, [struct.unpack("<QQ", _rpc_call(sock, RPC_CMD_GET_DEVICE_MEMORY))]
+        except struct.error as e:
+            raise ValueError(f"malformed reply for protocol {version}: {e}")
+    return version, sum(free for free, _ in memory), sum(total for _, total in memory), n_devices
+
+def rpc_version_compatible(server, client):
+    """llama.cpp's client rule: same major version, server minor not newer than the client's."""
+    server_major, server_minor = (int(x) for x in server.split(".")[:2])
+    client_major, client_minor = (int(x) for x in client.split(".")[:2])
+    return server_major == client_major and server_minor <= client_minor
+
+def wait_for_rpc(ip, port, deadline):
+    """Probes ip:port until the handshake succeeds or time.monotonic() passes deadline.
+
+    Returns (probe, None) or (None, error); protocol errors are not retried.
+    """
+    while True:
+        try:
+            return probe_rpc_server(ip, port), None
+        except ValueError as e:
+            return None, str(e)
+        except OSError as e:
+            if time.monotonic() >= deadline:
+                return None, f"no RPC handshake on port {port} before the deadline ({e or type(e).__name__})"
+            time.sleep(0.5)
+
+def local_rpc_version(image, deadline):
+    """Protocol version of the local llama.cpp build; returns (version, error).
+
+    RPC_PROTOCOL_VERSION wins when set. Otherwise a loopback-only rpc-server is
+    started from the local toolbox just long enough to answer HELLO.
+    """
+    if RPC_PROTOCOL_VERSION: return RPC_PROTOCOL_VERSION, None
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    cmd = ["rpc-server", "-H", "127.0.0.1", "-p", str(port)]
+    try:
+        proc = subprocess.Popen(["toolbox", "run", "-c", image, "--", *cmd],
+                                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except OSError as e:
+        return None, f"cannot start a local rpc-server ({e})"
+    try:
+        while proc.poll() is None and time.monotonic() < deadline:
+            try:
+                return probe_rpc_server("127.0.0.1", port)[0], None
+            except ValueError as e:
+                return None, str(e)
+            except OSError:
+                time.sleep(0.5)
+        return None, "the local rpc-server exited" if proc.poll() is not None else "no local RPC handshake before the deadline"
+    finally:
+        # Killing `toolbox run` does not reach the process inside the container.
+        subprocess.run(["pkill", "-f", " ".join(cmd)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        proc.terminate()
+        proc.wait()
+
+def bring_up_rpc_server(ip, image, deadline, sessions, remote_pids, pids_lock, pool=False):
+    """Connect + start + handshake probe for one host; returns (pid, error, reused, seconds, probe).
+
+    The PID goes into remote_pids as soon as the server starts, so a cleanup
+    that interrupts the probe still reaches it. A reused (pooled) server must
+    answer the first probe; one that does not (wedged, broken) is stopped and
+    started afresh instead of failing every later run.
+    """
+    def record(pid):
+        if pid:
+            with pids_lock: remote_pids[ip] = pid
+
+    start = time.monotonic()
+    pid, error, reused, probe = None, sessions.connect(ip), False, None
+    if not error: pid, error, reused = start_rpc_server(ip, image, sessions, pool)
+    record(pid)
+    if not error and reused:
+        probe, error = wait_for_rpc(ip, RPC_PORT, time.monotonic())
+        if error:
+            print(f"   {ip:<18} pooled RPC server (PID {pid}) failed the handshake ({error}); restarting it")
+            sessions.run(ip, "bash -s", input=rpc_stop_script(pid))
+            pid, error, reused = start_rpc_server(ip, image, sessions, pool)
+            record(pid)
+    if not error and not probe: probe, error = wait_for_rpc(ip, RPC_PORT, deadline)
+    return pid, error, reused, time.monotonic() - start, probe
+
+def bring_up_rpc_servers(active_ips, image, remote_pids, sessions, timeout=RPC_READY_TIMEOUT, pool=False):
+    """Starts and probes every RPC server concurrently under one overall deadline.
+
+    Fills remote_pids (ip -> PID) as servers start, so cleanup can reach them,
+    and prints one readiness line per host with its protocol version and
+    device memory. Returns {ip: (version, free, total, devices)} if every
+    server answered the handshake with the same protocol major version and is
+    compatible with the local build (see local_rpc_version), else None.
+    pool=True reuses servers left running by an earlier pool-mode run.
+    """
+    print(f"-> Starting RPC servers on {len(active_ips)} host(s) (deadline {timeout:g} s{', pool mode' if pool else ''})...")
+    deadline = time.monotonic() + timeout
+    pids_lock = threading.Lock()
+    check_local = RPC_PROTOCOL_VERSION != "off"
+    with ThreadPoolExecutor(max_workers=len(active_ips) + check_local) as executor:
+        local = executor.submit(local_rpc_version, image, deadline) if check_local else None
+        futures = {ip: executor.submit(bring_up_rpc_server, ip, image, deadline, sessions, remote_pids, pids_lock, pool)
+                   for ip in active_ips}
+        results = {ip: future.result() for ip, future in futures.items()}
+        local_version, local_error = local.result() if local else (None, None)
+    if local_error:
+        print(f"[WARN] Local RPC protocol version unknown ({local_error}); skipping the local/remote check. "
+              "Set RPC_PROTOCOL_VERSION=<x.y.z> to check against it, or =off to silence this.")
+    if local_version:
+        for ip, (pid, error, reused, elapsed, probe) in results.items():
+            if probe and not error and not rpc_version_compatible(probe[0], local_version):
+                error = f"RPC protocol {probe[0]} is incompatible with the local {local_version}"
+                results[ip] = (pid, error, reused, elapsed, probe)
+    gib = 1024**3
+    for ip, (pid, error, reused, elapsed, probe) in results.items():
+        status = f"[ERROR] {error}" if error else ("OK (reused)" if reused else "OK")
+        if probe:
+            version, free, total, n_devices = probe
+            status += f"  RPC {version}, {n_devices} device(s), {free / gib:.1f} / {total / gib:.1f} GiB free"
+        print(f"   {ip:<18} PID {pid or '-':<8} {elapsed:5.1f} s  {status}")
+        if error and pid:
+            log = sessions.run(ip, f"tail -n 5 /tmp/rpc-server-{ip}.log").stdout.rstrip()
+            if log: print("\n".join(f"      | {line}" for line in log.splitlines()))
+    if any(error for _, error, _, _, _ in results.values()):
+        return None
+    probes = {ip: result[4] for ip, result in results.items()}
+    if len({version.split(".")[0] for version, _, _, _ in probes.values()}) > 1:
+        print(f"[ERROR] Mismatched RPC protocol versions: {', '.join(f'{ip}={probe[0]}' for ip, probe in probes.items())}")
+        return None
+    return probes
+
+def local_command(state, image, rpc_arg, tensor_split=None):
+    """The llama.cpp command line run on this machine against the RPC servers in rpc_arg."""
+    # Base arguments for all modes
+    base_args = [
+        "toolbox", "run", "-c", image, "--",
+        state.mode,
+        "-m", state.model_path,
+        "--rpc", rpc_arg
+    ]
+
+    if state.mode == "llama-server":
+         # Llama Server specific
+         extra_args = [
+             "--no-mmap", 
+             "-fa", "1",
+             "--host", "0.0.0.0",
+             "--port", LOCAL_HOST_PORT
+         ]
+         if state.context_size:
+             extra_args.extend(["-c", str(state.context_size)])
+
+    elif state.mode == "llama-cli":
+         # Llama CLI specific (interactive or basic run)
+         # User requested -mmp 0 and -fa 1
+         extra_args = [
+             "--no-mmap",
+             "-fa", "1",
+             "-cnv", # Conversation mode seems appropriate for CLI
+             "-p", "You are a helpful assistant." 
+         ]
+         if state.context_size:
+             extra_args.extend(["-c", str(state.context_size)])
+
+    elif state.mode == "llama-bench":
+         # Llama Bench specific
+         # User requested -mmp 0 and -fa 1 (Note: llama-bench uses different arg names sometimes?)
+         # llama-bench: -mmp (mmap)
+         extra_args = [
+             "-mmp", "0",
+             "-fa", "1"
+         ]
+         # bench usually controls context via other flags, user didn't ask for it here.
+    else:
+         extra_args = []
+
+    if tensor_split:
+        # llama-bench takes '/'-separated splits
+        if state.mode == "llama-bench":
+            extra_args.extend(["-ts", tensor_split.replace(",", "/")])
+        else:
+            extra_args.extend(["--tensor-split", tensor_split])
+
+    return base_args + extra_args + state.extra_args
+
+# --- RPC Tensor Cache ---
+
+def cache_inventory(ip, sessions):
+    """{file: (bytes, last use as epoch seconds)} of the rpc-server tensor cache on ip.
+
+    Last use is the access time, so it has the host's atime granularity
+    (relatime: about once a day per file).
+    """
+    res = sessions.run(ip, f'find {RPC_CACHE_DIR} -maxdepth 1 -type f -printf "%f %s %A@\\n" 2>/dev/null || true')
+    inventory = {}
+    for line in res.stdout.splitlines():
+        parts = line.split()
+        if len(parts) == 3 and RPC_CACHE_FILE.match(parts[0]):
+            inventory[parts[0]] = (int(parts[1]), float(parts[2]))
+    return inventory
+
+def cache_inventories(active_ips, sessions):
+    with ThreadPoolExecutor(max_workers=len(active_ips)) as pool:
+        return dict(zip(active_ips, pool.map(lambda ip: cache_inventory(ip, sessions), active_ips)))
+
+def load_manifest():
+    try:
+        with open(CACHE_MANIFEST) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def record_cache_owner(before, after, model_path):
+    """Attributes the cache files a run added on each node to model_path."""
+    manifest = load_manifest()
+    for ip, files in after.items():
+        added = set(files) - set(before.get(ip, {}))
+        if added: manifest.setdefault(ip, {}).update(dict.fromkeys(added, Path(model_path).name))
+    CACHE_MANIFEST.parent.mkdir(parents=True, exist_ok=True)
+    with open(CACHE_MANIFEST, "w") as f:
+        json.dump(manifest, f, indent=1)
+
+def evict_cache(ip, sessions, max_bytes):
+    """Deletes the least recently used cache files on ip until the cache fits in max_bytes; returns (files, bytes) removed."""
+    inventory = cache_inventory(ip, sessions)
+    total = sum(size for size, _ in inventory.values())
+    victims = []
+    for name, (size, _) in sorted(inventory.items(), key=lambda item: item[1][1]):
+        if total <= max_bytes: break
+        victims.append(name)
+        total -= size
+    for i in range(0, len(victims), 500):
+        sessions.run(ip, f"cd {RPC_CACHE_DIR} && rm -f -- {' '.join(victims[i:i + 500])}")
+    return len(victims), sum(inventory[name][0] for name in victims)
+
+def enforce_cache_cap(active_ips, sessions, max_bytes):
+    estimator = load_estimator()
+    with ThreadPoolExecutor(max_workers=len(active_ips)) as pool:
+        evicted = list(pool.map(lambda ip: evict_cache(ip, sessions, max_bytes), active_ips))
+    for ip, (count, size) in zip(active_ips, evicted):
+        if count: print(f"   {ip}: evicted {count} least recently used tensor(s), {estimator.format_mem(size).strip()}")
+
+def print_cache_inventory(active_ips, sessions, model_path=None):
+    """Per node: cache size, and how much of it belongs to each model the manifest knows about."""
+    estimator = load_estimator()
+    manifest = load_manifest()
+    for ip, inventory in cache_inventories(active_ips, sessions).items():
+        total = sum(size for size, _ in inventory.values())
+        print(f"{ip}: {len(inventory)} cached tensor(s), {estimator.format_mem(total).strip()}")
+        owners = defaultdict(list)
+        for name, entry in inventory.items():
+            owners[manifest.get(ip, {}).get(name, "(unknown model)")].append(entry)
+        for owner, entries in sorted(owners.items(), key=lambda item: -max(t for _, t in item[1])):
+            last_use = time.strftime("%Y-%m-%d %H:%M", time.localtime(max(t for _, t in entries)))
+            print(f"   {owner[:50]:<50} {len(entries):>5} tensor(s) {estimator.format_mem(sum(size for size, _ in entries))}  last used {last_use}")
+        if model_path:
+            known = [name for name, owner in manifest.get(ip, {}).items() if owner == Path(model_path).name]
+            hits = sum(1 for name in known if name in inventory)
+            status = f"{hits}/{len(known)} of its recorded tensors cached" if known else "never loaded through this node (no record)"
+            print(f"   -> {Path(model_path).name}: {status}")
+
 # --- Custom File Picker ---
 
 def get_directory_contents(path):
@@ -143,6 +681,12 @@ class AppState:
         # List of [ip, enabled]
         self.hosts = [list(h) for h in DEFAULT_HOSTS]
         self.context_size = None # None means default (do not pass -c)
+        # Appended verbatim to the local llama.cpp command
+        self.extra_args = []
+        # Pool mode: leave the RPC servers running after the run and reuse matching ones
+        self.keep_servers = False
+        # Evict least recently used rpc-server cache files above this many bytes per node before each run
+        self.cache_max = None
 
     @property
     def active_hosts(self):
@@ -314,20 +858,33 @@ def configure_servers(state):
         elif selection == "4":
             edit_server(state)
 
-def run_distributed(state):
+def run_distributed(state, interactive=True, dry_run=False):
+    """Starts the RPC servers and the local llama.cpp process; returns its exit code (1 on setup errors).
+
+    interactive=False (headless mode) reports errors on stderr instead of in
+    dialog boxes and never waits for a key press. dry_run only prints the
+    commands every node would run.
+    """
+    def fail(msg):
+        if interactive: show_msg("Error", msg)
+        else: print(f"[ERROR] {msg}", file=sys.stderr)
+        return 1
+
     if not state.model_path or not os.path.exists(state.model_path):
-        show_msg("Error", f"Model file not found:\n{state.model_path}")
-        return
+        return fail(f"Model file not found:\n{state.model_path}")
 
     if not state.active_hosts:
-        show_msg("Error", "No remote servers selected.")
-        return
+        return fail("No remote servers selected.")
 
     image = TOOLBOX_IMAGES[state.toolbox]
     active_ips = state.active_hosts
+
+    if dry_run:
+        print_dry_run(state, image, active_ips)
+        return 0
     
     # Clear screen for execution output
-    subprocess.run(["clear"])
+    if interactive: subprocess.run(["clear"])
     print(f"=== Starting Distributed Run ===")
     print(f"Model:   {state.model_path}")
     print(f"Toolbox: {state.toolbox} ({image})")
@@ -336,152 +893,174 @@ def run_distributed(state):
     print(f"Hosts:   {active_ips}")
     print("--------------------------------")
 
-    remote_pids = []
-    
+    remote_pids = {}
+    sessions = SSHSessions()
+
+    def kill_remote(ip):
+        pid = remote_pids.pop(ip)
+        print(f"Killing remote RPC on {ip} (PID: {pid})...")
+        sessions.run(ip, "bash -s", input=rpc_stop_script(pid))
+
     def cleanup():
         print("\nCleaning up...")
-        for i, ip in enumerate(active_ips):
-            if i < len(remote_pids):
-                pid = remote_pids[i]
-                if pid:
-                    print(f"Killing remote RPC on {ip} (PID: {pid})...")
-                    subprocess.run(
-                        ["ssh", "-p", REMOTE_PORT, ip, f"kill -9 {pid} 2>/dev/null || true; pkill -9 -f rpc-server || true"], 
-                        stderr=subprocess.DEVNULL
-                    )
-
-    # Register signal handler for cleanup
+        if state.keep_servers and remote_pids:
+            print(f"Keeping {len(remote_pids)} RPC server(s) running for the next run (pool mode).")
+            remote_pids.clear()
+        if remote_pids:
+            with ThreadPoolExecutor(max_workers=len(remote_pids)) as pool:
+                list(pool.map(kill_remote, list(remote_pids)))
+
+    # Register signal handler for cleanup (SIGTERM: systemd stop)
     def signal_handler(sig, frame):
         cleanup()
         sys.exit(0)
     signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
 
+    returncode = 1
+    cache_before = None
     try:
-        rpc_arg_parts = []
-        
-        # 1. Start Remote RPC Servers
-        for ip in active_ips:
-            print(f"-> Starting RPC server on {ip}...")
-            
-            # Using bash heredoc via ssh to start background process and print PID
-            # We assume 'toolbox' command exists on remote
-            cmd_str = f"""
-            set -euo pipefail
-            pkill -9 -f rpc-server || true
-            nohup toolbox run -c {image} -- rpc-server -H 0.0.0.0 -p {RPC_PORT} -c > /tmp/rpc-server-{ip}.log 2>&1 < /dev/null &
-            echo $!
-            """
-            
-            res = subprocess.run(
-                ["ssh", "-p", REMOTE_PORT, ip, "bash -s"],
-                input=cmd_str, text=True, capture_output=True
-            )
-            
-            if res.returncode != 0:
-                print(f"[ERROR] SSH failed for {ip}: {res.stderr}")
-                cleanup()
-                return
-
-            pid = res.stdout.strip()
-            # Basic validation
-            if not pid.isdigit():
-                 lines = pid.splitlines()
-                 if lines and lines[-1].isdigit():
-                     pid = lines[-1]
-                 else:
-                    print(f"[ERROR] Invalid PID returned from {ip}: {pid}")
-                    cleanup()
-                    return
-                
-            remote_pids.append(pid)
-            print(f"   PID: {pid}")
-
-            # Wait for port check
-            print(f"   Waiting for port {RPC_PORT}...", end="", flush=True)
-            ready = False
-            for _ in range(30):
-                import socket
-                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                s.settimeout(1)
-                try:
-                    s.connect((ip, int(RPC_PORT)))
-                    s.close()
-                    ready = True
-                    print(" OK.")
-                    break
-                except:
-                    time.sleep(1)
-            
-            if not ready:
-                print(" TIMEOUT.")
-                print(f"[ERROR] Failed to connect to {ip}:{RPC_PORT}")
-                cleanup()
-                return
-            
-            rpc_arg_parts.append(f"{ip}:{RPC_PORT}")
+        # 1. Start Remote RPC Servers (all hosts at once)
+        probes = bring_up_rpc_servers(active_ips, image, remote_pids, sessions, pool=state.keep_servers)
+        if probes is None:
+            print("[ERROR] Not every RPC server came up.")
+            return returncode
+
+        if state.cache_max is not None: enforce_cache_cap(active_ips, sessions, state.cache_max)
+        cache_before = cache_inventories(active_ips, sessions)
 
-        rpc_arg = ",".join(rpc_arg_parts)
+        rpc_arg = ",".join(f"{ip}:{RPC_PORT}" for ip in active_ips)
         print(f"All servers ready. RPC Arg: {rpc_arg}")
+        tensor_split = plan_tensor_split(state, active_ips, sessions, probes)
         print(f"Starting Local {state.mode}...")
         print("--------------------------------")
 
         # 2. Run Local Executable
-        # Base arguments for all modes
-        base_args = [
-            "toolbox", "run", "-c", image, "--",
-            state.mode,
-            "-m", state.model_path,
-            "--rpc", rpc_arg
-        ]
-
-        if state.mode == "llama-server":
-             # Llama Server specific
-             extra_args = [
-                 "--no-mmap", 
-                 "-fa", "1",
-                 "--host", "0.0.0.0",
-                 "--port", LOCAL_HOST_PORT
-             ]
-             if state.context_size:
-                 extra_args.extend(["-c", str(state.context_size)])
-
-        elif state.mode == "llama-cli":
-             # Llama CLI specific (interactive or basic run)
-             # User requested -mmp 0 and -fa 1
-             extra_args = [
-                 "--no-mmap",
-                 "-fa", "1",
-                 "-cnv", # Conversation mode seems appropriate for CLI
-                 "-p", "You are a helpful assistant." 
-             ]
-             if state.context_size:
-                 extra_args.extend(["-c", str(state.context_size)])
-
-        elif state.mode == "llama-bench":
-             # Llama Bench specific
-             # User requested -mmp 0 and -fa 1 (Note: llama-bench uses different arg names sometimes?)
-             # llama-bench: -mmp (mmap)
-             extra_args = [
-                 "-mmp", "0",
-                 "-fa", "1"
-             ]
-             # bench usually controls context via other flags, user didn't ask for it here.
-        else:
-             extra_args = []
-
-        local_cmd = base_args + extra_args
+        local_cmd = local_command(state, image, rpc_arg, tensor_split)
         
         print(f"CMD: {' '.join(local_cmd)}")
         
         proc = subprocess.Popen(local_cmd)
-        proc.wait()
+        returncode = proc.wait()
         
     except Exception as e:
         print(f"\n[EXCEPTION] {e}")
     finally:
         cleanup()
+        if cache_before is not None:
+            record_cache_owner(cache_before, cache_inventories(active_ips, sessions), state.model_path)
+        sessions.summary(active_ips)
+        sessions.close()
     
-    input("\nRun complete. Press Enter to return to menu...")
+    if interactive: input("\nRun complete. Press Enter to return to menu...")
+    return returncode
+
+def print_dry_run(state, image, active_ips):
+    """Prints, without contacting any node, the command every node would run."""
+    rpc_arg = ",".join(f"{ip}:{RPC_PORT}" for ip in active_ips)
+    for ip in active_ips:
+        print(f"# {ip}: ssh -p {REMOTE_PORT} {ip} bash -s <<'EOF'")
+        print(textwrap.dedent(rpc_server_script(ip, image, state.keep_servers)).strip())
+        print("EOF")
+    print(f"# local (--tensor-split is planned from each node's free memory at run time)")
+    print(shlex.join(local_command(state, image, rpc_arg)))
+
+# --- Headless Mode ---
+
+PROFILE_KEYS = {"model", "toolbox", "mode", "hosts", "context", "extra_args", "keep_servers", "cache_max"}
+
+def load_profile(path):
+    """Reads a .toml or .json run profile into a dict."""
+    with open(path, "rb") as f:
+        if path.endswith(".toml"):
+            import tomllib  # Python 3.11+
+            return tomllib.load(f)
+        return json.load(f)
+
+def apply_profile(state, profile):
+    """Copies a profile's settings onto state; raises ValueError on unknown keys or values.
+
+    Keys: model, toolbox, mode, context, hosts (IPs, or {ip, enabled} tables),
+    extra_args (a list, or one string split like a shell would), keep_servers and
+    cache_max (a size such as "200GiB").
+    """
+    unknown = set(profile) - PROFILE_KEYS
+    if unknown: raise ValueError(f"Unknown profile key(s): {', '.join(sorted(unknown))}")
+    if "model" in profile: state.model_path = os.path.expanduser(str(profile["model"]))
+    if "toolbox" in profile:
+        if profile["toolbox"] not in TOOLBOX_IMAGES: raise ValueError(f"Unknown toolbox {profile['toolbox']!r}; one of {', '.join(TOOLBOX_IMAGES)}")
+        state.toolbox = profile["toolbox"]
+    if "mode" in profile:
+        if profile["mode"] not in MODES: raise ValueError(f"Unknown mode {profile['mode']!r}; one of {', '.join(MODES)}")
+        state.mode = profile["mode"]
+    if "context" in profile: state.context_size = int(profile["context"]) if profile["context"] else None
+    if "hosts" in profile:
+        state.hosts = [[h, True] if isinstance(h, str) else [h["ip"], bool(h.get("enabled", True))] for h in profile["hosts"]]
+    if "extra_args" in profile:
+        extra = profile["extra_args"]
+        state.extra_args = shlex.split(extra) if isinstance(extra, str) else [str(a) for a in extra]
+    if "keep_servers" in profile: state.keep_servers = bool(profile["keep_servers"])
+    if "cache_max" in profile: state.cache_max = load_estimator().parse_size(str(profile["cache_max"])) if profile["cache_max"] else None
+
+def parse_args():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Run llama.cpp across Strix Halo nodes over RPC. Without arguments, opens the dialog menus;\n"
+                    "with any argument, runs headless (e.g. under systemd) with no prompts.",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--profile", help=f"TOML or JSON profile with any of: {', '.join(sorted(PROFILE_KEYS))}.")
+    parser.add_argument("--model", help="GGUF model path (overrides the profile).")
+    parser.add_argument("--toolbox", choices=list(TOOLBOX_IMAGES), help=f"Toolbox (default: {DEFAULT_TOOLBOX}).")
+    parser.add_argument("--mode", choices=MODES, help=f"Executable to run locally (default: {DEFAULT_MODE}).")
+    parser.add_argument("--hosts", nargs="+", metavar="IP", help="RPC hosts, in --rpc order.")
+    parser.add_argument("-c", "--context", type=int, help="Context size passed as -c (default: model default).")
+    parser.add_argument("--extra-args", help="Extra llama.cpp arguments, e.g. \"-np 4 --jinja\".")
+    parser.add_argument("--keep-servers", action="store_true", default=None, help="Pool mode: leave the RPC servers running after the run and reuse\nthose that match the toolbox, build and port next time.")
+    parser.add_argument("--stop-servers", action="store_true", help="Stop the RPC servers (e.g. a pool) on the hosts and exit.")
+    parser.add_argument("--cache-list", action="store_true", help="List each node's rpc-server tensor cache by model (and, with a model,\nhow much of it is cached) and exit.")
+    parser.add_argument("--cache-max", metavar="SIZE", help="Cap each node's tensor cache, e.g. 200GiB: least recently used files are\nevicted before the run (or with --cache-list, before listing).")
+    parser.add_argument("--cache-seed", action="store_true", help="Pre-warm the nodes' tensor caches for the model with a minimal llama-bench\nload (same split as a real run) instead of running it.")
+    parser.add_argument("--dry-run", action="store_true", help="Print the per-node commands and exit.")
+    return parser.parse_args()
+
+def run_headless(args):
+    state = AppState()
+    try:
+        if args.profile: apply_profile(state, load_profile(args.profile))
+        apply_profile(state, {key: value for key, value in (
+            ("model", args.model), ("toolbox", args.toolbox), ("mode", args.mode), ("hosts", args.hosts),
+            ("context", args.context), ("extra_args", args.extra_args), ("keep_servers", args.keep_servers),
+            ("cache_max", args.cache_max)) if value is not None})
+    except (OSError, ValueError, KeyError, TypeError, ImportError) as e:
+        print(f"[ERROR] Invalid profile: {e}", file=sys.stderr)
+        return 2
+    if args.stop_servers:
+        sessions = SSHSessions()
+        try:
+            unreachable = stop_rpc_servers(state.active_hosts, sessions)
+        finally:
+            sessions.close()
+        if unreachable: print(f"[ERROR] Could not stop the RPC server on {', '.join(unreachable)}", file=sys.stderr)
+        return 1 if unreachable else 0
+    if args.cache_list:
+        sessions = SSHSessions()
+        try:
+            unreachable = [ip for ip in state.active_hosts if sessions.connect(ip)]
+            if unreachable: print(f"[ERROR] Could not reach {', '.join(unreachable)}", file=sys.stderr)
+            reachable = [ip for ip in state.active_hosts if ip not in unreachable]
+            if reachable and state.cache_max is not None: enforce_cache_cap(reachable, sessions, state.cache_max)
+            if reachable: print_cache_inventory(reachable, sessions, state.model_path or None)
+        finally:
+            sessions.close()
+        return 1 if unreachable else 0
+    if not state.model_path:
+        print("[ERROR] No model given: pass --model or a --profile with a model key.", file=sys.stderr)
+        return 2
+    if args.cache_seed:
+        # Same model, toolbox, hosts and context (hence the same split), but only a load.
+        state.mode, state.extra_args = "llama-bench", list(CACHE_SEED_ARGS)
+    return run_distributed(state, interactive=False, dry_run=args.dry_run)
 
 
 def main_menu():
@@ -495,14 +1074,15 @@ def main_menu():
         menu = [
             "--clear", "--backtitle", "AMD Strix Halo - Distributed Llama",
             "--title", "Main Menu",
-            "--menu", "Select an option to configure or run:", "20", "60", "7",
+            "--menu", "Select an option to configure or run:", "20", "60", "8",
             "1", f"Model:   {model_display}",
             "2", f"Toolbox: {state.toolbox}",
             "3", f"Servers: {servers_display}",
             "4", f"Mode:    {state.mode}",
             "5", f"Context: {context_display}",
-            "6", "RUN DISTRIBUTED SERVER",
-            "7", "Exit"
+            "6", f"Pool:    {'keep servers running' if state.keep_servers else 'off'}",
+            "7", "RUN DISTRIBUTED SERVER",
+            "8", "Exit"
         ]
         
         choice, code = run_dialog(menu)
@@ -521,14 +1101,20 @@ def main_menu():
         elif choice == "5":
             select_context(state)
         elif choice == "6":
-            run_distributed(state)
+            state.keep_servers = not state.keep_servers
         elif choice == "7":
+            run_distributed(state)
+        elif choice == "8":
             break
 
     subprocess.run(["clear"])
     exit(0)
 
 if __name__ == "__main__":
+    args = parse_args()
+    # Any flag means headless: the menus would silently drop it, and hang a script or unit waiting for input.
+    if any(value not in (None, False) for value in vars(args).values()):
+        sys.exit(run_headless(args))
     check_dependencies()
     try:
         main_menu()
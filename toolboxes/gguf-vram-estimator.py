@@ -1,162 +1,1504 @@
 #!/usr/bin/env python3
+"""Estimates llama.cpp memory use for GGUF models from their headers.
+
+Besides the CLI, the module can be loaded in-process (it is named with
+hyphens, so via importlib.util.spec_from_file_location) and used through
+estimate(), which returns an Estimate and raises instead of exiting.
+Importing it does no I/O; heavier stdlib modules are imported where used.
+"""
 import sys
 import os
 import re
+import glob
+import json
+import hashlib
 import struct
-import argparse
 import math
-from typing import Dict, Any, List
+import mmap
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field, replace
+from typing import Dict, Any, List, NamedTuple, Optional, Tuple
 
 # GGUF constants
 GGUF_MAGIC = 0x46554747
 GGUF_VALUE_TYPE = {
     0: "UINT8", 1: "INT8", 2: "UINT16", 3: "INT16", 4: "UINT32",
     5: "INT32", 6: "FLOAT32", 7: "BOOL", 8: "STRING", 9: "ARRAY",
+    10: "UINT64", 11: "INT64", 12: "FLOAT64",
+}
+GGUF_SCALAR_SIZE = {0: 1, 1: 1, 2: 2, 3: 2, 4: 4, 5: 4, 6: 4, 7: 1, 10: 8, 11: 8, 12: 8}
+
+GGUF_DEFAULT_ALIGNMENT = 32
+
+# ggml tensor types: id -> (name, elements per block, bytes per block)
+GGML_TYPES = {
+    0: ("F32", 1, 4), 1: ("F16", 1, 2), 2: ("Q4_0", 32, 18), 3: ("Q4_1", 32, 20),
+    6: ("Q5_0", 32, 22), 7: ("Q5_1", 32, 24), 8: ("Q8_0", 32, 34), 9: ("Q8_1", 32, 36),
+    10: ("Q2_K", 256, 84), 11: ("Q3_K", 256, 110), 12: ("Q4_K", 256, 144), 13: ("Q5_K", 256, 176),
+    14: ("Q6_K", 256, 210), 15: ("Q8_K", 256, 292), 16: ("IQ2_XXS", 256, 66), 17: ("IQ2_XS", 256, 74),
+    18: ("IQ3_XXS", 256, 98), 19: ("IQ1_S", 256, 50), 20: ("IQ4_NL", 32, 18), 21: ("IQ3_S", 256, 110),
+    22: ("IQ2_S", 256, 82), 23: ("IQ4_XS", 256, 136), 24: ("I8", 1, 1), 25: ("I16", 1, 2),
+    26: ("I32", 1, 4), 27: ("I64", 1, 8), 28: ("F64", 1, 8), 29: ("IQ1_M", 256, 56),
+    30: ("BF16", 1, 2), 34: ("TQ1_0", 256, 54), 35: ("TQ2_0", 256, 66), 39: ("MXFP4", 32, 17),
+}
+GGML_TYPE_IDS = {name: type_id for type_id, (name, _, _) in GGML_TYPES.items()}
+TENSOR_CLASSES = ["embeddings", "attn", "ffn", "experts", "ssm", "output", "other"]
+
+# --what-if presets, approximating llama-quantize's mixes. Rules are KEY=TYPE, first match wins;
+# KEY is a tensor class, a substring of the tensor name or "*". "A/B" gives A to the layers
+# llama-quantize's use_more_bits() picks (about half) and B to the rest.
+QUANT_PRESETS = {
+    "Q3_K_M": "attn_v=Q5_K/Q4_K,ffn_down=Q5_K/Q4_K,output=Q6_K,*=Q3_K",
+    "Q4_K_M": "attn_v=Q6_K/Q4_K,ffn_down=Q6_K/Q4_K,output=Q6_K,*=Q4_K",
+    "Q5_K_M": "attn_v=Q6_K/Q5_K,ffn_down=Q6_K/Q5_K,output=Q6_K,*=Q5_K",
+    "Q6_K": "*=Q6_K",
+    "Q8_0": "*=Q8_0",
+}
+# Tensors llama-quantize never requantizes, whatever the target type.
+KEEP_TYPE_PATTERN = re.compile(r"ffn_gate_inp\.|pos_embd|token_types|ssm_conv1d|shortconv\.conv|attn_rel_b|"
+                               r"time_mix_(first|w0|w1|w2|decay_w1|decay_w2|lerp_fused)")
+# llama-quantize's fallback when a row is not a multiple of the type's block size.
+QUANT_FALLBACKS = {"Q2_K": "IQ4_NL", "Q3_K": "IQ4_NL", "Q4_K": "Q5_0", "Q5_K": "Q5_1", "Q6_K": "Q8_0",
+                   "IQ2_XXS": "IQ4_NL", "IQ2_XS": "IQ4_NL", "IQ2_S": "IQ4_NL", "IQ3_XXS": "IQ4_NL",
+                   "IQ3_S": "IQ4_NL", "IQ1_S": "IQ4_NL", "IQ1_M": "IQ4_NL", "IQ4_XS": "IQ4_NL"}
+
+# Architecture-specific hyperparameters kept by the reader, without the "<arch>." prefix.
+ARCH_KEYS = [
+    "block_count", "context_length", "embedding_length", "feed_forward_length", "vocab_size",
+    "attention.head_count", "attention.head_count_kv", "attention.key_length",
+    "attention.value_length", "attention.sliding_window_size", "attention.sliding_window_pattern",
+    "expert_count", "expert_used_count", "expert_feed_forward_length",
+    "expert_shared_feed_forward_length", "expert_shared_count",
+    "attention.kv_lora_rank", "rope.dimension_count", "full_attention_interval",
+    "ssm.conv_kernel", "ssm.inner_size", "ssm.state_size", "ssm.group_count",
+    "wkv.head_size", "token_shift_count",
+]
+# Encoder hyperparameters of --mmproj files (architecture "clip"), per modality.
+PROJECTOR_KEYS = [f"{modality}.{key}" for modality in ("vision", "audio") for key in (
+    "embedding_length", "feed_forward_length", "attention.head_count", "block_count",
+    "projection_dim", "image_size", "patch_size")]
+# Encoder positions of a 30 s audio clip after the Whisper-style stride-2 convolution.
+AUDIO_ENCODER_POSITIONS = 1500
+
+# SWA period llama.cpp hardcodes per architecture when the GGUF has no
+# sliding_window_pattern: n-1 sliding-window layers, then one full-attention layer.
+SWA_PATTERNS = {"gemma2": 2, "gemma3": 6, "gemma3n": 5, "cohere2": 4, "gpt-oss": 2, "llama4": 4}
+
+# Keys gguf-split writes into every shard of a split model.
+SPLIT_KEYS = ["split.no", "split.count", "split.tensors.count"]
+
+# Remote (HTTP range) reads: first request size, grown as the header needs more.
+REMOTE_READ_AHEAD = 1 << 20
+REMOTE_TIMEOUT = 30
+
+# Bump whenever the reader starts keeping different keys or tensor fields (or the entry layout changes).
+CACHE_VERSION = 7
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "gguf-vram-estimator")
+
+# Types llama.cpp accepts for -ctk / -ctv, and the symmetric pairs compared in the report.
+KV_CACHE_TYPES = ["f32", "f16", "bf16", "q8_0", "q5_1", "q5_0", "q4_1", "q4_0", "iq4_nl"]
+KV_COMPARE_TYPES = ["f16", "q8_0", "q5_1", "q5_0", "q4_1", "q4_0"]
+
+# Driver / runtime allocations outside llama.cpp's own buffers.
+RUNTIME_RESERVE_BYTES = 512 * 1024**2
+
+# Load-time lines printed by llama.cpp, e.g.
+#   load_tensors:        ROCm0 model buffer size = 17562.46 MiB
+#   llama_kv_cache:      ROCm0 KV buffer size =  1024.00 MiB
+#   llama_context:       ROCm0 compute buffer size =   258.50 MiB
+LOG_BUFFER_PATTERNS = {
+    "model_bytes": r"model buffer size\s*=\s*([\d.]+) MiB",
+    "kv_bytes": r"(?:KV buffer size|KV self size)\s*=\s*([\d.]+) MiB",
+    "compute_bytes": r"compute buffer size\s*=\s*([\d.]+) MiB",
 }
+# Older llama.cpp prints the per-device "KV buffer size" lines and then their total as "KV self size".
+LOG_KV_TOTAL = "KV self size"
+LOG_SETTING_PATTERNS = {
+    "n_ctx": r"\bn_ctx\s*=\s*(\d+)",
+    "n_batch": r"\bn_batch\s*=\s*(\d+)",
+    "n_ubatch": r"\bn_ubatch\s*=\s*(\d+)",
+    "flash_attn": r"\bflash_attn\s*=\s*(\w+)",
+    "n_seq_max": r"\bn_seq_max\s*=\s*(\d+)",
+    "kv_unified": r"\bkv_unified\s*=\s*(\w+)",
+    "type_k": r"\bK \((\w+)\):",
+    "type_v": r"\bV \((\w+)\):",
+}
+
+DEFAULT_CONTEXTS = [4096, 8192, 16384, 32768, 65536, 131072, 262144, 524288, 1048576]
+DEFAULT_SCAN_CONTEXTS = [8192, 32768, 131072]
+MAX_SEARCH_CONTEXT = 1 << 24
+CONTEXT_STEP = 256
+SOLVER_SLOTS = [1, 2, 4, 8]
+# LLAMA_MAX_SEQ: the most -np slots llama.cpp accepts.
+MAX_PARALLEL_SEQUENCES = 256
+
+# Routed-expert weights that llama.cpp's --n-cpu-moe / --cpu-moe move to host memory.
+EXPERT_TENSOR_PATTERN = re.compile(r"^blk\.(\d+)\.ffn_(gate_up|gate|up|down)_exps\.")
+
+GGUF_HEADER = struct.Struct("<IIQQ")
+ARRAY_HEADER = struct.Struct("<IQ")
+TENSOR_INFO_TAIL = struct.Struct("<IQ")
+U32, I32, U64 = struct.Struct("<I"), struct.Struct("<i"), struct.Struct("<Q")
+# STRING_RUN consecutive length-prefixed strings shorter than 64 bytes (nearly every token and
+# merge), matched by the regex engine in one call: one branch per length, keyed on the prefix.
+STRING_RUN = 64
+SHORT_STRING_RUN = re.compile(b"(?:" + b"|".join(re.escape(U64.pack(n)) + b".{%d}" % n for n in range(64)) +
+                              b"){%d}" % STRING_RUN, re.DOTALL)
+GGUF_SCALAR_FORMAT = {i: struct.Struct("<" + c) for i, c in {
+    0: "B", 1: "b", 2: "H", 3: "h", 4: "I", 5: "i", 6: "f", 7: "?", 10: "Q", 11: "q", 12: "d"}.items()}
+
+class TensorInfo(NamedTuple):
+    """One entry of a shard's tensor-info table."""
+    name: str
+    shape: Tuple[int, ...]
+    ggml_type: int
+    offset: int
+    n_bytes: int
+
+    @property
+    def type_name(self) -> str:
+        return GGML_TYPES[self.ggml_type][0] if self.ggml_type in GGML_TYPES else f"type{self.ggml_type}"
+
+    @property
+    def n_elements(self) -> int:
+        return math.prod(self.shape)
+
+    @property
+    def layer(self) -> Optional[int]:
+        parts = self.name.split(".")
+        return int(parts[1]) if parts[0] == "blk" and len(parts) > 2 and parts[1].isdigit() else None
+
+    @property
+    def tensor_class(self) -> str:
+        return classify_tensor(self.name)
+
+def classify_tensor(name: str) -> str:
+    """Buckets a tensor name into one of TENSOR_CLASSES."""
+    parts = name.split(".")
+    if parts[0] == "blk" and len(parts) > 2:
+        role = parts[2]
+        if "_exps" in role or "_chexps" in role or role == "exp_probs_b": return "experts"
+        if role.startswith(("attn", "post_attention")): return "attn"
+        if role.startswith(("ffn", "post_ffw")): return "ffn"
+        if role.startswith("ssm"): return "ssm"
+        return "other"
+    if parts[0] in ("token_embd", "per_layer_token_embd", "token_types", "position_embd"): return "embeddings"
+    if parts[0] in ("output", "output_norm"): return "output"
+    return "other"
+
+class TruncatedHeaderError(ValueError):
+    """The header runs past the end of the bytes available; `needed` is the offset reached, if known."""
+    def __init__(self, needed: int = 0):
+        super().__init__("Unexpected end of file in GGUF header")
+        self.needed = needed
+
+def is_remote(path: str) -> bool:
+    return path.startswith(("http://", "https://"))
+
+def http_range(url: str, start: int, length: int) -> Tuple[bytes, int]:
+    """Fetches bytes [start, start + length) of url; returns them and the total file size."""
+    import urllib.error
+    import urllib.request
+    request = urllib.request.Request(url, headers={"Range": f"bytes={start}-{start + length - 1}", "User-Agent": "gguf-vram-estimator"})
+    try:
+        with urllib.request.urlopen(request, timeout=REMOTE_TIMEOUT) as response:
+            if response.status == 206:
+                return response.read(), int(response.headers["Content-Range"].rsplit("/", 1)[1])
+            # No range support (e.g. python -m http.server): read only up to the end of the wanted range.
+            return response.read(start + length)[start:], int(response.headers.get("Content-Length") or 0)
+    except urllib.error.HTTPError as e:
+        raise FileNotFoundError(f"{url}: HTTP {e.code} {e.reason}") from None
 
 class GGUFMetadataReader:
-    """A minimal reader to get only the necessary KV metadata for cache calculation."""
-    def __init__(self, path: str):
+    """A minimal reader to get only the necessary KV metadata for cache calculation.
+
+    The file is memory-mapped and the KV section is walked in place with
+    struct.unpack_from, so skipped values cost an offset bump instead of a read().
+    With read_tensors=True it carries on into the tensor-info table.
+
+    HTTP(S) URLs are read with range requests instead: one contiguous range
+    from offset 0, grown until the header and tensor-info table parse.
+    """
+    def __init__(self, path: str, read_tensors: bool = True):
         self.path = path
+        self.read_tensors = read_tensors
         self.metadata: Dict[str, Any] = {}
+        self.tensors: List[TensorInfo] = []
+        self.data_offset = 0
 
     def read(self):
-        with open(self.path, "rb") as f:
-            self.f = f
-            magic, _, _, metadata_kv_count = struct.unpack("<IIQQ", self.f.read(24))
+        if is_remote(self.path): return self._read_remote()
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            self._parse(memoryview(mm), len(mm))
+        return self
+
+    def _read_remote(self):
+        data, file_size = http_range(self.path, 0, REMOTE_READ_AHEAD)
+        data = bytearray(data)
+        while True:
+            try:
+                self._parse(memoryview(data), file_size)
+                return self
+            except TruncatedHeaderError as e:
+                if len(data) >= file_size: raise
+                # Read ahead at least as much as we already have, so the number of requests stays logarithmic.
+                length = min(max(e.needed - len(data), 0) + max(len(data), REMOTE_READ_AHEAD), file_size - len(data))
+                chunk, _ = http_range(self.path, len(data), length)
+                if not chunk: raise
+                data += chunk
+
+    def _parse(self, buf: memoryview, file_size: int):
+        """Parses the header in buf, which holds the first len(buf) of file_size bytes."""
+        self.buf, self.pos, self.file_size = buf, 0, file_size
+        self.metadata, self.tensors = {}, []
+        try:
+            magic, _, tensor_count, metadata_kv_count = GGUF_HEADER.unpack_from(self.buf, 0)
             if magic != GGUF_MAGIC: raise ValueError("Invalid GGUF magic number")
+            self.pos = GGUF_HEADER.size
             self._read_metadata(metadata_kv_count)
-        return self
+            if self.read_tensors: self._read_tensor_infos(tensor_count)
+        except struct.error:
+            raise TruncatedHeaderError(self.pos) from None
+        finally:
+            self.buf.release()
+            del self.buf
+
+    def _unpack(self, fmt: struct.Struct):
+        values = fmt.unpack_from(self.buf, self.pos)
+        self.pos += fmt.size
+        return values
+
+    def _advance(self, n: int):
+        self.pos += n
+        if self.pos > len(self.buf): raise TruncatedHeaderError(self.pos)
 
     def _read_string(self) -> str:
-        (length,) = struct.unpack("<Q", self.f.read(8))
-        return self.f.read(length).decode("utf-8", errors="replace")
+        (length,) = self._unpack(U64)
+        start = self.pos
+        self._advance(length)
+        return str(self.buf[start:self.pos], "utf-8", errors="replace")
 
     def _read_value(self, value_type_idx: int):
         value_type = GGUF_VALUE_TYPE.get(value_type_idx)
         if not value_type: raise ValueError(f"Unknown GGUF value type: {value_type_idx}")
         if value_type == "STRING": return self._read_string()
-        if value_type == "UINT32": return struct.unpack("<I", self.f.read(4))[0]
-        if value_type == "INT32": return struct.unpack("<i", self.f.read(4))[0]
+        if value_type_idx in GGUF_SCALAR_FORMAT: return self._unpack(GGUF_SCALAR_FORMAT[value_type_idx])[0]
+        array_type_idx, count = ARRAY_HEADER.unpack_from(self.buf, self.pos)
+        if array_type_idx in GGUF_SCALAR_FORMAT:
+            # Per-layer arrays (head counts, feed-forward sizes, SWA patterns) are small; read them whole.
+            self.pos += ARRAY_HEADER.size
+            values = list(struct.unpack_from(f"<{count}{GGUF_SCALAR_FORMAT[array_type_idx].format[1:]}", self.buf, self.pos))
+            self.pos += count * GGUF_SCALAR_SIZE[array_type_idx]
+            return values
         self._skip_value(value_type_idx)
 
     def _skip_value(self, value_type_idx: int):
+        element_size = GGUF_SCALAR_SIZE.get(value_type_idx)
+        if element_size:
+            self.pos += element_size
+            return
         value_type = GGUF_VALUE_TYPE.get(value_type_idx)
-        if not value_type: return
-        if value_type in ("UINT8", "INT8", "BOOL"): self.f.seek(1, 1)
-        elif value_type in ("UINT16", "INT16"): self.f.seek(2, 1)
-        elif value_type in ("UINT32", "INT32", "FLOAT32"): self.f.seek(4, 1)
-        elif value_type == "STRING":
-            (length,) = struct.unpack("<Q", self.f.read(8))
-            self.f.seek(length, 1)
+        if not value_type: raise ValueError(f"Unknown GGUF value type: {value_type_idx}")
+        if value_type == "STRING":
+            self.pos += U64.size + U64.unpack_from(self.buf, self.pos)[0]
         elif value_type == "ARRAY":
-            (array_type_idx, count) = struct.unpack("<IQ", self.f.read(12))
-            type_map = {0:1, 1:1, 2:2, 3:2, 4:4, 5:4, 6:4, 7:1, 10:8, 11:8, 12:8}
-            element_size = type_map.get(array_type_idx)
-            if element_size: self.f.seek(count * element_size, 1)
+            array_type_idx, count = self._unpack(ARRAY_HEADER)
+            element_size = GGUF_SCALAR_SIZE.get(array_type_idx)
+            if element_size: self.pos += count * element_size
+            elif array_type_idx == 8: self._skip_string_array(count)
             else:
-                for _ in range(count): self._skip_value(8)
+                for _ in range(count): self._skip_value(array_type_idx)
+        if self.pos > len(self.buf): raise TruncatedHeaderError(self.pos)
+
+    def _skip_string_array(self, count: int):
+        """Skip `count` length-prefixed strings (tokenizer vocabularies and merges).
+
+        Each offset depends on the previous length, so the walk cannot be a
+        single unpack; runs of short strings go through SHORT_STRING_RUN instead,
+        and only a run holding a long string (or the tail) is walked per element.
+        """
+        unpack_from, match, buf, pos = U64.unpack_from, SHORT_STRING_RUN.match, self.buf, self.pos
+        while count:
+            run = match(buf, pos) if count >= STRING_RUN else None
+            if run:
+                pos = run.end()
+                count -= STRING_RUN
+                continue
+            for _ in range(min(count, STRING_RUN)):
+                pos += unpack_from(buf, pos)[0] + 8
+            count -= min(count, STRING_RUN)
+        self.pos = pos
+
+    def _read_tensor_infos(self, count: int):
+        raw = []
+        for _ in range(count):
+            name = self._read_string()
+            (n_dims,) = self._unpack(U32)
+            shape = struct.unpack_from(f"<{n_dims}Q", self.buf, self.pos)
+            self.pos += 8 * n_dims
+            ggml_type, offset = self._unpack(TENSOR_INFO_TAIL)
+            raw.append((name, shape, ggml_type, offset))
+
+        alignment = self.metadata.get("general.alignment") or GGUF_DEFAULT_ALIGNMENT
+        self.data_offset = -(-self.pos // alignment) * alignment
+        data_size = self.file_size - self.data_offset
+
+        # Unknown (newer) quant types are sized from the gap to the next tensor's offset.
+        next_offsets = sorted({offset for _, _, _, offset in raw} | {data_size})
+        for name, shape, ggml_type, offset in raw:
+            if ggml_type in GGML_TYPES:
+                _, block_size, type_size = GGML_TYPES[ggml_type]
+                n_bytes = math.prod(shape) // block_size * type_size
+            else:
+                n_bytes = next_offsets[next_offsets.index(offset) + 1] - offset
+            if offset + n_bytes > data_size:
+                raise ValueError(f"{self.path}: tensor '{name}' ends {offset + n_bytes - data_size:,} bytes past the end of the file (truncated download?)")
+            self.tensors.append(TensorInfo(name, tuple(shape), ggml_type, offset, n_bytes))
 
     def _read_metadata(self, count: int):
-        keys_to_read = {"general.architecture", "general.name"}
+        keys_to_read = {"general.architecture", "general.name", "general.alignment", *SPLIT_KEYS}
         arch_specific_keys_added = False
         for _ in range(count):
             key = self._read_string()
-            (value_type_idx,) = struct.unpack("<I", self.f.read(4))
+            (value_type_idx,) = self._unpack(U32)
             if not arch_specific_keys_added and "general.architecture" in self.metadata:
                 prefix = self.metadata["general.architecture"]
-                keys_to_read.update({
-                    f"{prefix}.block_count", f"{prefix}.context_length",
-                    f"{prefix}.attention.head_count_kv", f"{prefix}.attention.key_length",
-                    f"{prefix}.attention.value_length", f"{prefix}.attention.sliding_window_size"
-                })
+                keys_to_read.update(f"{prefix}.{key}" for key in ARCH_KEYS + PROJECTOR_KEYS)
                 arch_specific_keys_added = True
             if key in keys_to_read:
                 self.metadata[key] = self._read_value(value_type_idx)
             else:
                 self._skip_value(value_type_idx)
 
-def get_total_model_size_from_disk(gguf_file_path: str) -> int:
-    """Calculates the total model size by finding all parts on disk."""
-    match = re.search(r'-(\d{5})-of-(\d{5})\.gguf$', gguf_file_path, re.IGNORECASE)
+def find_model_shards(gguf_file_path: str) -> List[str]:
+    """Returns every part of a multi-part model (or just the file itself), in order.
+
+    Raises FileNotFoundError if any part named by the -NNNNN-of-NNNNN suffix is missing.
+    """
+    match = re.search(r'-(\d{5})-of-(\d{5})\.gguf(\?.*)?$', gguf_file_path, re.IGNORECASE)
     if not match:
-        return os.path.getsize(gguf_file_path)
+        return [gguf_file_path]
 
     base_path = gguf_file_path[:match.start()]
     total_parts_str = match.group(2)
     total_parts = int(total_parts_str)
-    total_size, found_parts = 0, 0
-    for i in range(1, total_parts + 1):
-        part_file_name = f"{base_path}-{i:05d}-of-{total_parts_str}.gguf"
-        if os.path.exists(part_file_name):
-            total_size += os.path.getsize(part_file_name)
-            found_parts += 1
-    if found_parts != total_parts:
-        print(f"WARNING: Expected {total_parts} parts, found {found_parts}. Size calculation may be incomplete.", file=sys.stderr)
-    return total_size
+    shards = [f"{base_path}-{i:05d}-of-{total_parts_str}.gguf{match.group(3) or ''}" for i in range(1, total_parts + 1)]
+    # Remote parts are checked when they are fetched.
+    if is_remote(gguf_file_path): return shards
+    missing = [os.path.basename(shard) for shard in shards if not os.path.exists(shard)]
+    if missing:
+        raise FileNotFoundError(f"Expected {total_parts} parts, missing {len(missing)}: {', '.join(missing)}")
+    return shards
+
+def verify_shards(readers: List["GGUFMetadataReader"]):
+    """Checks the split.* header keys of every shard against each other and the file names."""
+    n_shards = len(readers)
+    first = readers[0].metadata
+    expected_count = first.get("split.count", 1)
+    if expected_count != n_shards:
+        raise ValueError(f"{readers[0].path}: header says split.count = {expected_count}, but {n_shards} file(s) were found")
+    for i, reader in enumerate(readers):
+        split_no, split_count = reader.metadata.get("split.no", 0), reader.metadata.get("split.count", 1)
+        if (split_no, split_count) != (i, n_shards):
+            raise ValueError(f"{reader.path}: header says part {split_no + 1} of {split_count}, expected part {i + 1} of {n_shards} (mismatched shard?)")
+    n_tensors = sum(len(reader.tensors) for reader in readers)
+    expected_tensors = first.get("split.tensors.count", n_tensors)
+    if n_tensors != expected_tensors:
+        raise ValueError(f"{readers[0].path}: split.tensors.count = {expected_tensors:,}, but the shards list {n_tensors:,} tensors")
+
+class ModelInfo:
+    """Metadata of the first shard plus the tensor tables of all shards."""
+    def __init__(self, path: str, shards: List[str], metadata: Dict[str, Any], tensors: List[TensorInfo]):
+        self.path = path
+        self.shards = shards
+        self.metadata = metadata
+        self.tensors = tensors
+
+    @property
+    def weight_bytes(self) -> int:
+        return sum(t.n_bytes for t in self.tensors)
+
+    def weight_breakdown(self) -> Dict[str, Dict[Any, int]]:
+        """Weight bytes grouped by layer, tensor class and quant type."""
+        breakdown = {"layer": defaultdict(int), "class": defaultdict(int), "type": defaultdict(int)}
+        for t in self.tensors:
+            breakdown["layer"][t.layer] += t.n_bytes
+            breakdown["class"][t.tensor_class] += t.n_bytes
+            breakdown["type"][t.type_name] += t.n_bytes
+        return breakdown
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"path": self.path, "shards": self.shards, "metadata": self.metadata,
+                "tensors": [[t.name, list(t.shape), t.ggml_type, t.offset, t.n_bytes] for t in self.tensors]}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ModelInfo":
+        tensors = [TensorInfo(name, tuple(shape), ggml_type, offset, n_bytes)
+                   for name, shape, ggml_type, offset, n_bytes in data["tensors"]]
+        return cls(data["path"], data["shards"], data["metadata"], tensors)
+
+class ModelCache:
+    """Persistent cache of parsed model headers.
+
+    One JSON file per model under `cache_dir`, keyed by the real path of its
+    first shard and valid only while every shard keeps its size and mtime.
+    Writes are atomic, so concurrent estimator runs can share the directory.
+    """
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _entry_path(self, shards: List[str]) -> str:
+        key = hashlib.sha1(os.path.realpath(shards[0]).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    @staticmethod
+    def _fingerprint(shards: List[str]) -> List[List[Any]]:
+        fingerprint = []
+        for shard in shards:
+            st = os.stat(shard)
+            fingerprint.append([os.path.realpath(shard), st.st_size, st.st_mtime_ns])
+        return fingerprint
+
+    def get(self, gguf_file: str) -> Optional[ModelInfo]:
+        """Returns the cached ModelInfo for `gguf_file`, or None if missing or stale."""
+        shards = find_model_shards(gguf_file)
+        if not shards: return None
+        try:
+            with open(self._entry_path(shards)) as f:
+                entry = json.load(f)
+            if entry.get("version") != CACHE_VERSION or entry.get("fingerprint") != self._fingerprint(shards):
+                return None
+            model = ModelInfo.from_dict(entry["model"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        model.path, model.shards = gguf_file, shards
+        return model
+
+    def put(self, model: ModelInfo):
+        """Stores `model` under real paths, so entries() works from any directory; failures (read-only home, full disk) are ignored."""
+        try:
+            shards = [os.path.realpath(shard) for shard in model.shards]
+            entry = {"version": CACHE_VERSION, "fingerprint": self._fingerprint(shards),
+                     "model": dict(model.to_dict(), path=os.path.realpath(model.path), shards=shards)}
+            import tempfile
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._entry_path(shards))
+        except OSError:
+            pass
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Summaries of every valid entry, for model pickers that should not touch the files."""
+        summaries = []
+        for name in sorted(os.listdir(self.cache_dir)) if os.path.isdir(self.cache_dir) else []:
+            if not name.endswith(".json"): continue
+            try:
+                with open(os.path.join(self.cache_dir, name)) as f:
+                    entry = json.load(f)
+                model = ModelInfo.from_dict(entry["model"])
+                if entry.get("version") != CACHE_VERSION or entry["fingerprint"] != self._fingerprint(model.shards):
+                    continue
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+            summaries.append({"path": model.path, "name": model.metadata.get("general.name"),
+                              "architecture": model.metadata.get("general.architecture"),
+                              "weight_bytes": model.weight_bytes, "shards": len(model.shards)})
+        return summaries
+
+def load_model_info(gguf_file: str, cache: Optional[ModelCache] = None) -> ModelInfo:
+    """Reads the header of the first shard and the tensor-info tables of all shards.
+
+    Shards are read in parallel and checked with verify_shards(): truncated or
+    mismatched files raise ValueError, missing ones FileNotFoundError. With a
+    `cache`, a fresh entry is returned without opening the model and a miss is
+    parsed and stored. HTTP(S) URLs are read with range requests and not cached.
+    """
+    if is_remote(gguf_file): cache = None
+    if cache:
+        model = cache.get(gguf_file)
+        if model: return model
+    shards = find_model_shards(gguf_file)
+    if len(shards) > 1:
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(shards), 16)) as pool:
+            readers = list(pool.map(lambda shard: GGUFMetadataReader(shard).read(), shards))
+    else:
+        readers = [GGUFMetadataReader(shards[0]).read()]
+    verify_shards(readers)
+    model = ModelInfo(gguf_file, shards, readers[0].metadata, [t for r in readers for t in r.tensors])
+    if cache: cache.put(model)
+    return model
 
 def format_mem(size_bytes):
     mib = size_bytes / (1024 * 1024)
     if mib < 1024: return f"{mib:8.2f} MiB"
     return f"{mib / 1024:8.2f} GiB"
 
-def run_estimator(gguf_file: str, context_sizes: List[int], overhead_gib: float):
+def print_weight_breakdown(model: ModelInfo, per_layer: bool):
+    breakdown = model.weight_breakdown()
+    total = model.weight_bytes or 1
+    print("\n--- Weights by Tensor Class ---")
+    for cls in TENSOR_CLASSES:
+        if cls in breakdown["class"]:
+            size = breakdown["class"][cls]
+            print(f"{cls:>15s} | {format_mem(size):>15s} | {100 * size / total:5.1f}%")
+    print("\n--- Weights by Quant Type ---")
+    for type_name, size in sorted(breakdown["type"].items(), key=lambda kv: -kv[1]):
+        print(f"{type_name:>15s} | {format_mem(size):>15s} | {100 * size / total:5.1f}%")
+    if per_layer:
+        print("\n--- Weights by Layer ---")
+        for layer, size in sorted(breakdown["layer"].items(), key=lambda kv: (kv[0] is None, kv[0] or 0)):
+            label = f"blk.{layer}" if layer is not None else "non-layer"
+            print(f"{label:>15s} | {format_mem(size):>15s}")
+
+@dataclass
+class RunConfig:
+    """llama.cpp runtime settings that change the memory footprint."""
+    cache_type_k: str = "f16"
+    cache_type_v: str = "f16"
+    n_batch: int = 2048
+    n_ubatch: int = 512
+    flash_attn: bool = True
+    n_parallel: int = 1
+    # --kv-unified: the -np slots share one n_ctx-cell cache instead of n_ctx / np cells each.
+    kv_unified: bool = False
+    # --mmproj / -md models loaded next to the main one, and the draft's -cd / -ctkd / -ctvd.
+    companions: Tuple["Companion", ...] = ()
+    n_ctx_draft: Optional[int] = None
+    cache_type_k_draft: str = "f16"
+    cache_type_v_draft: str = "f16"
+    # Flat replacement for compute buffer + runtime reserve (the old --overhead); None derives it.
+    overhead_bytes: Optional[int] = None
+    # Measured / estimated compute buffer ratio from llama.cpp logs (--calibrate-log).
+    compute_scale: float = 1.0
+
+def ggml_row_bytes(type_name: str, n_elements: int) -> int:
+    """Bytes for n_elements of a ggml type, like ggml_row_size()."""
+    for name, block_size, type_size in GGML_TYPES.values():
+        if name.lower() == type_name.lower():
+            return -(-n_elements // block_size) * type_size
+    raise ValueError(f"Unknown ggml type: {type_name}")
+
+_REQUIRED = object()
+
+def hparam(metadata: Dict[str, Any], key: str, default: Any = _REQUIRED) -> Any:
+    """Reads `<arch>.<key>`; raises KeyError if it is missing and no default is given."""
+    prefix = metadata.get("general.architecture")
+    if not prefix: raise KeyError("Could not read 'general.architecture' from model metadata.")
+    value = metadata.get(f"{prefix}.{key}")
+    if value is None:
+        if default is _REQUIRED: raise KeyError(f"{prefix}.{key}")
+        return default
+    return value
+
+def as_list(value: Any) -> List[Any]:
+    return value if isinstance(value, list) else [value]
+
+def head_dims(metadata: Dict[str, Any]) -> Tuple[int, int]:
+    """K and V head sizes; GGUFs omit key_length/value_length when they equal n_embd / n_head."""
+    n_head = max(as_list(hparam(metadata, "attention.head_count", 0)))
+    default = hparam(metadata, "embedding_length", 0) // n_head if n_head else 0
+    return hparam(metadata, "attention.key_length", default), hparam(metadata, "attention.value_length", default)
+
+class LayerSpec(NamedTuple):
+    """What one layer keeps in memory: K/V elements per cached token, and f32
+    recurrent-state elements (conv/shift + SSM/WKV) per sequence."""
+    n_embd_k: int
+    n_embd_v: int
+    swa: bool
+    n_embd_r: int
+    n_embd_s: int
+
+def layer_plan(metadata: Dict[str, Any]) -> List[LayerSpec]:
+    """Per-layer cache shapes for classic GQA, MLA and hybrid attention/recurrent models."""
+    n_layers = hparam(metadata, "block_count")
+    # Like llama.cpp, a GGUF without head_count_kv is plain MHA (phi2, gpt2, ...): one KV head per head.
+    head_count_kv = hparam(metadata, "attention.head_count_kv", None)
+    if head_count_kv is None: head_count_kv = hparam(metadata, "attention.head_count", 0)
+    per_layer_head_kv = isinstance(head_count_kv, list)
+    heads_kv = head_count_kv if per_layer_head_kv else [head_count_kv] * n_layers
+    n_embd_head_k, n_embd_head_v = head_dims(metadata)
+
+    kv_lora_rank = hparam(metadata, "attention.kv_lora_rank", 0)
+    if kv_lora_rank:
+        # MLA (DeepSeek-style) caches one compressed latent plus the RoPE slice per token, not per head.
+        n_embd_k = kv_lora_rank + hparam(metadata, "rope.dimension_count", 0)
+        attn = [(n_embd_k, kv_lora_rank) if h else (0, 0) for h in heads_kv]
+    else:
+        attn = [(h * n_embd_head_k, h * n_embd_head_v) for h in heads_kv]
+
+    full_attention_interval = hparam(metadata, "full_attention_interval", 0)
+    if full_attention_interval:
+        # Qwen3-Next style: every Nth layer is full attention, the rest are linear attention.
+        attn = [kv if (il + 1) % full_attention_interval == 0 else (0, 0) for il, kv in enumerate(attn)]
+
+    n_embd_r = n_embd_s = 0
+    d_inner = hparam(metadata, "ssm.inner_size", 0)
+    wkv_head_size = hparam(metadata, "wkv.head_size", 0)
+    if d_inner:
+        d_conv, d_state = hparam(metadata, "ssm.conv_kernel", 0), hparam(metadata, "ssm.state_size", 0)
+        n_group = hparam(metadata, "ssm.group_count", 0) or 1
+        n_embd_r = max(d_conv - 1, 0) * (d_inner + 2 * n_group * d_state)
+        n_embd_s = d_state * d_inner
+    elif wkv_head_size:
+        n_embd = hparam(metadata, "embedding_length")
+        n_embd_r = hparam(metadata, "token_shift_count", 2) * n_embd
+        n_embd_s = n_embd * wkv_head_size
+    # With per-layer head counts or an interval, layers without attention are the recurrent ones;
+    # otherwise (pure SSM/RWKV, or Falcon-H1 style parallel hybrids) every layer carries state.
+    alternating = per_layer_head_kv or full_attention_interval
+    recurrent = [bool(n_embd_r or n_embd_s) and (not alternating or not any(kv)) for kv in attn]
+
+    swa = swa_layers(metadata, n_layers)
+    return [LayerSpec(k, v, swa[il], n_embd_r if recurrent[il] else 0, n_embd_s if recurrent[il] else 0)
+            for il, (k, v) in enumerate(attn)]
+
+def swa_layers(metadata: Dict[str, Any], n_layers: int) -> List[bool]:
+    """Which layers use sliding-window (or chunked) attention.
+
+    `attention.sliding_window_pattern` wins when present: either a per-layer
+    bool array or a period n (n-1 SWA layers, then one full-attention layer).
+    Otherwise the period llama.cpp hardcodes for the architecture is used, and
+    any remaining model with a window is all-SWA (e.g. Mistral 7B v0.1)."""
+    if not swa_window(metadata): return [False] * n_layers
+    pattern = hparam(metadata, "attention.sliding_window_pattern", None)
+    if isinstance(pattern, list):
+        return [bool(x) for x in pattern[:n_layers]] + [False] * (n_layers - len(pattern))
+    period = pattern if pattern is not None else SWA_PATTERNS.get(metadata.get("general.architecture"), 0)
+    return [period == 0 or il % period < period - 1 for il in range(n_layers)]
+
+def swa_window(metadata: Dict[str, Any]) -> int:
+    window = hparam(metadata, "attention.sliding_window_size", None)
+    # llama4 uses 8192-token chunked attention unless the GGUF sets the window to 0.
+    if window is None and metadata.get("general.architecture") == "llama4": return 8192
+    return window or 0
+
+def n_vocab(model: "ModelInfo") -> int:
+    for t in model.tensors:
+        if t.name in ("token_embd.weight", "output.weight") and len(t.shape) == 2: return t.shape[1]
+    return hparam(model.metadata, "vocab_size", 0)
+
+def slot_context(n_ctx: int, config: RunConfig) -> int:
+    """Cells each KV stream holds: all of n_ctx when unified, else n_ctx / np per slot (llama.cpp's n_ctx_seq)."""
+    return n_ctx if config.kv_unified else n_ctx // max(1, config.n_parallel)
+
+def kv_layer_bytes(metadata: Dict[str, Any], n_ctx: int, config: Optional[RunConfig] = None) -> List[int]:
+    """KV cache plus recurrent state in bytes for each layer at n_ctx tokens of context."""
+    config = config or RunConfig()
+    window = swa_window(metadata)
+    n_ctx_seq = slot_context(n_ctx, config)
+    n_stream = 1 if config.kv_unified else config.n_parallel
+    # An SWA stream keeps the window of every sequence it serves plus one ubatch.
+    swa_cells = min(n_ctx_seq, window * (config.n_parallel if config.kv_unified else 1) + config.n_ubatch)
+    sizes = []
+    for layer in layer_plan(metadata):
+        size = config.n_parallel * (layer.n_embd_r + layer.n_embd_s) * 4
+        if layer.n_embd_k or layer.n_embd_v:
+            cells = n_stream * (swa_cells if layer.swa else n_ctx_seq)
+            size += cells * (ggml_row_bytes(config.cache_type_k, layer.n_embd_k) +
+                             ggml_row_bytes(config.cache_type_v, layer.n_embd_v))
+        sizes.append(size)
+    return sizes
+
+def kv_cache_bytes(metadata: Dict[str, Any], n_ctx: int, config: Optional[RunConfig] = None) -> int:
+    """KV cache plus recurrent state in bytes for n_ctx tokens of context."""
+    return sum(kv_layer_bytes(metadata, n_ctx, config))
+
+def compute_buffer_bytes(model: "ModelInfo", n_ctx: int, config: Optional[RunConfig] = None) -> int:
+    """Estimated llama.cpp compute buffers (device + host) for one ubatch at n_ctx.
+
+    ggml-alloc reuses memory between ops, so the device buffer is sized by the
+    largest single phase of the graph (logits, FFN or attention) plus the
+    residual stream that stays live across it.
+    """
+    config = config or RunConfig()
+    metadata = model.metadata
+    n_ubatch = min(config.n_batch, config.n_ubatch)
+    n_embd = hparam(metadata, "embedding_length")
+    n_head = max(as_list(hparam(metadata, "attention.head_count", 0)))
+    n_embd_kv = max((layer.n_embd_k + layer.n_embd_v for layer in layer_plan(metadata)), default=0)
+    n_ff = max(as_list(hparam(metadata, "feed_forward_length", 0)))
+    n_ff_moe = (hparam(metadata, "expert_feed_forward_length", 0) * hparam(metadata, "expert_used_count", 0) +
+                hparam(metadata, "expert_shared_feed_forward_length", 0))
+
+    act = n_ubatch * n_embd * 4
+    logits = n_ubatch * n_vocab(model) * 4
+    ffn = 2 * n_ubatch * max(n_ff, n_ff_moe) * 4
+    if config.flash_attn:
+        attn = 4 * act
+        if config.cache_type_k != "f16" or config.cache_type_v != "f16":
+            # Quantized K/V are converted to f16 one layer at a time for the FA kernels.
+            attn += n_ctx * n_embd_kv * 2
+    else:
+        # KQ spans one stream's cells; the ubatch's tokens are spread across the streams.
+        attn = n_ubatch * slot_context(n_ctx, config) * n_head * 4 + 2 * act
+    device = max(logits, ffn, attn) + 3 * act
+    host = 2 * act
+    return int((device + host) * config.compute_scale)
+
+def overhead_bytes(model: "ModelInfo", n_ctx: int, config: Optional[RunConfig] = None) -> int:
+    """Everything besides weights and KV: compute buffers plus a runtime reserve, or the flat --overhead."""
+    config = config or RunConfig()
+    if config.overhead_bytes is not None: return config.overhead_bytes
+    return compute_buffer_bytes(model, n_ctx, config) + RUNTIME_RESERVE_BYTES
+
+def encoder_compute_bytes(projector: "ModelInfo", config: RunConfig) -> int:
+    """Compute buffer clip.cpp reserves for the largest input of a --mmproj file: one full-size image,
+    or a 30 s audio clip, through the encoder at once."""
+    sizes = [0]
+    for modality in ("vision", "audio"):
+        n_embd = hparam(projector.metadata, f"{modality}.embedding_length", 0)
+        if not n_embd: continue
+        if modality == "vision":
+            n_pos = (hparam(projector.metadata, "vision.image_size", 0) // max(1, hparam(projector.metadata, "vision.patch_size", 1))) ** 2
+        else:
+            n_pos = AUDIO_ENCODER_POSITIONS
+        n_head = hparam(projector.metadata, f"{modality}.attention.head_count", 1)
+        n_ff = hparam(projector.metadata, f"{modality}.feed_forward_length", 4 * n_embd)
+        act = n_pos * n_embd * 4
+        attn = 4 * act if config.flash_attn else n_pos * n_pos * n_head * 4 + 2 * act
+        sizes.append(max(2 * n_pos * n_ff * 4, attn) + 3 * act)
+    return max(sizes)
+
+def draft_config(config: RunConfig) -> RunConfig:
+    """The context llama-server gives the -md draft model: one per slot, single-sequence, with the -ctkd / -ctvd types."""
+    return replace(config, cache_type_k=config.cache_type_k_draft, cache_type_v=config.cache_type_v_draft,
+                   n_parallel=1, kv_unified=False, companions=(), overhead_bytes=None, compute_scale=1.0)
+
+def companion_bytes(n_ctx: int, config: Optional[RunConfig] = None) -> int:
+    """Weights plus runtime memory of the --mmproj / -md models in config at n_ctx tokens of main context."""
+    config = config or RunConfig()
+    total = 0
+    for companion in config.companions:
+        total += companion.model.weight_bytes
+        if companion.role == "mmproj":
+            total += encoder_compute_bytes(companion.model, config)
+        else:
+            n_ctx_draft = config.n_ctx_draft or slot_context(n_ctx, config)
+            per_slot = (kv_cache_bytes(companion.model.metadata, n_ctx_draft, draft_config(config)) +
+                        compute_buffer_bytes(companion.model, n_ctx_draft, draft_config(config)))
+            total += config.n_parallel * per_slot
+    return total
+
+def total_bytes(model: "ModelInfo", n_ctx: int, config: Optional[RunConfig] = None) -> int:
+    return (model.weight_bytes + kv_cache_bytes(model.metadata, n_ctx, config) + overhead_bytes(model, n_ctx, config) +
+            companion_bytes(n_ctx, config))
+
+def training_context(metadata: Dict[str, Any]) -> int:
+    return metadata.get(f"{metadata.get('general.architecture')}.context_length", 0)
+
+def max_context_for_budget(model: ModelInfo, budget_bytes: int, config: Optional[RunConfig] = None) -> int:
+    """Largest -c value whose estimated total fits in budget_bytes; 0 if none.
+
+    Memory is monotonic in context, so this is a binary search over multiples
+    of CONTEXT_STEP (llama.cpp pads n_ctx to 256), capped at the training
+    context.
+    """
+    limit = training_context(model.metadata) or MAX_SEARCH_CONTEXT
+    if total_bytes(model, limit, config) <= budget_bytes: return limit
+    lo, hi = 0, limit // CONTEXT_STEP
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if total_bytes(model, mid * CONTEXT_STEP, config) <= budget_bytes: lo = mid
+        else: hi = mid - 1
+    return lo * CONTEXT_STEP
+
+def max_sessions_for_budget(model: ModelInfo, budget_bytes: int, n_ctx_seq: int, config: Optional[RunConfig] = None) -> int:
+    """Most -np slots of n_ctx_seq tokens each (-c np * n_ctx_seq) that fit in budget_bytes; 0 if none."""
+    config = config or RunConfig()
+    fits = lambda n: total_bytes(model, n * n_ctx_seq, replace(config, n_parallel=n)) <= budget_bytes
+    lo, hi = 0, MAX_PARALLEL_SEQUENCES
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if fits(mid): lo = mid
+        else: hi = mid - 1
+    return lo
+
+class Companion(NamedTuple):
+    """A GGUF llama-server loads next to the model: a --mmproj projector ("mmproj") or a -md draft ("draft")."""
+    role: str
+    model: ModelInfo
+
+def load_companions(files: List[Tuple[str, str]], cache: Optional[ModelCache] = None) -> Tuple[Companion, ...]:
+    """Loads (role, path) pairs, checking that each file is what its role expects."""
+    companions = []
+    for role, path in files:
+        model = load_model_info(path, cache)
+        is_projector = model.metadata.get("general.architecture") == "clip"
+        if is_projector != (role == "mmproj"):
+            raise ValueError(f"{path} is {'a' if is_projector else 'not a'} multimodal projector; "
+                             f"pass it as {'--mmproj' if is_projector else '-md'}")
+        companions.append(Companion(role, model))
+    return tuple(companions)
+
+class OffloadPlan(NamedTuple):
+    """One placement of routed-expert tensors between GPU and host memory."""
+    name: str
+    flags: List[str]
+    gpu_bytes: int
+    cpu_bytes: int
+    cpu_bytes_per_token: int
+
+def expert_groups(model: ModelInfo) -> Dict[Tuple[int, str], int]:
+    """Bytes of each (layer, role) routed-expert tensor group, e.g. (3, "up")."""
+    groups: Dict[Tuple[int, str], int] = defaultdict(int)
+    for t in model.tensors:
+        match = EXPERT_TENSOR_PATTERN.match(t.name)
+        if match: groups[(int(match.group(1)), match.group(2))] += t.n_bytes
+    return dict(groups)
+
+def override_tensor_flags(cpu_groups: List[Tuple[int, str]]) -> List[str]:
+    """-ot flags sending the given (layer, role) groups to CPU, one per set of roles."""
+    roles_by_layer: Dict[int, List[str]] = defaultdict(list)
+    for il, role in cpu_groups: roles_by_layer[il].append(role)
+    layers_by_roles: Dict[Tuple[str, ...], List[int]] = defaultdict(list)
+    for il, roles in sorted(roles_by_layer.items()): layers_by_roles[tuple(sorted(roles))].append(il)
+    alternation = lambda items: items[0] if len(items) == 1 else f"({'|'.join(items)})"
+    return [f'-ot "blk\\.{alternation([str(il) for il in layers])}\\.ffn_{alternation(list(roles))}_exps=CPU"'
+            for roles, layers in layers_by_roles.items()]
+
+def plan_expert_offload(model: ModelInfo, budget_bytes: int, n_ctx: int, config: RunConfig) -> List[OffloadPlan]:
+    """Placements of routed experts that fit budget_bytes at n_ctx, fewest host bytes read per token first.
+
+    Every token reads expert_used_count / expert_count of each layer's routed
+    experts, so a byte of experts costs the same wherever it sits and the best
+    plan is the one that keeps the most expert bytes on the GPU.
+    """
+    groups = expert_groups(model)
+    if not groups: return []
+    n_expert = hparam(model.metadata, "expert_count", 0)
+    n_expert_used = hparam(model.metadata, "expert_used_count", 0)
+    fixed = total_bytes(model, n_ctx, config) - sum(groups.values())
+    room = budget_bytes - fixed
+
+    def make(name: str, flags: List[str], cpu: List[Tuple[int, str]]) -> OffloadPlan:
+        cpu_bytes = sum(groups[g] for g in cpu)
+        per_token = cpu_bytes * n_expert_used // n_expert if n_expert else cpu_bytes
+        return OffloadPlan(name, flags, fixed + sum(groups.values()) - cpu_bytes, cpu_bytes, per_token)
+
+    plans = [make("all on GPU", [], []), make("all experts on CPU", ["--cpu-moe"], list(groups))]
+    if room >= sum(groups.values()): return plans[:1]
+    # --n-cpu-moe N keeps the experts of blk.0 .. blk.N-1 on the CPU.
+    n_layers = max(il for il, _ in groups) + 1
+    for n in range(1, n_layers):
+        cpu = [g for g in groups if g[0] < n]
+        if sum(groups[g] for g in cpu) >= sum(groups.values()) - room:
+            plans.append(make(f"first {n} layers' experts on CPU", [f"--n-cpu-moe {n}"], cpu))
+            break
+    # Per-tensor packing: largest groups first, each one on the GPU while it still fits.
+    cpu, free = [], room
+    for group in sorted(groups, key=lambda g: (-groups[g], g)):
+        if groups[group] <= free: free -= groups[group]
+        else: cpu.append(group)
+    if cpu and len(cpu) < len(groups):
+        plans.append(make(f"{len(cpu)} expert tensors on CPU", override_tensor_flags(sorted(cpu)), cpu))
+    return sorted((p for p in plans if p.gpu_bytes <= budget_bytes), key=lambda p: (p.cpu_bytes_per_token, len(p.flags)))
+
+def parse_quant_rules(text: str) -> List[Tuple[str, str]]:
+    """Turns a QUANT_PRESETS name or 'attn=Q8_0,experts=Q4_K' into (key, type) rules."""
+    text = QUANT_PRESETS.get(text.upper(), text)
+    rules = []
+    for item in text.split(","):
+        key, sep, type_name = item.partition("=")
+        if not sep or not key.strip(): raise ValueError(f"Invalid quant rule {item!r}; expected KEY=TYPE or one of {', '.join(QUANT_PRESETS)}")
+        for name in type_name.upper().split("/"):
+            if name not in GGML_TYPE_IDS: raise ValueError(f"Unknown ggml type {name!r} in {item!r}")
+        rules.append((key.strip(), type_name.strip().upper()))
+    return rules
+
+def use_more_bits(layer: int, n_layers: int) -> bool:
+    """llama-quantize's choice of layers that get the larger type in *_M mixes."""
+    return layer < n_layers // 8 or layer >= 7 * n_layers // 8 or (layer - n_layers // 8) % 3 == 2
+
+def requantize(model: ModelInfo, rules: List[Tuple[str, str]]) -> ModelInfo:
+    """A copy of model with every matrix a rule matches re-typed and re-sized; 1-D tensors and KEEP_TYPE_PATTERN keep their type."""
+    n_layers = hparam(model.metadata, "block_count", 0)
+    tensors = []
+    for t in model.tensors:
+        target = next((type_name for key, type_name in rules
+                       if key == "*" or key == t.tensor_class or (key not in TENSOR_CLASSES and key in t.name)), None)
+        if target and len(t.shape) > 1 and not KEEP_TYPE_PATTERN.search(t.name):
+            if "/" in target:
+                more, less = target.split("/")
+                target = more if t.layer is not None and use_more_bits(t.layer, n_layers) else less
+            _, block_size, _ = GGML_TYPES[GGML_TYPE_IDS[target]]
+            if t.shape[0] % block_size: target = QUANT_FALLBACKS.get(target, "F16")
+            n_bytes = ggml_row_bytes(target, t.shape[0]) * math.prod(t.shape[1:])
+            t = t._replace(ggml_type=GGML_TYPE_IDS[target], n_bytes=n_bytes)
+        tensors.append(t)
+    return ModelInfo(model.path, model.shards, model.metadata, tensors)
+
+class NodeLoad(NamedTuple):
+    """Estimated memory use of one llama.cpp device under a --tensor-split."""
+    name: str
+    layers: int
+    weight_bytes: int
+    kv_bytes: int
+    compute_bytes: int
+    budget_bytes: int
+
+    @property
+    def total_bytes(self) -> int:
+        return self.weight_bytes + self.kv_bytes + self.compute_bytes
+
+def split_loads(model: ModelInfo, nodes: List[Tuple[str, int]], counts: List[int], n_ctx: int, config: RunConfig) -> List[NodeLoad]:
+    """Per-node usage when node i gets the next counts[i] layers, as llama.cpp's layer split assigns them.
+
+    The last node also holds the output layer, and, as the host running
+    llama-server, the token embeddings (kept in host memory but on the same
+    unified memory pool here) and any --mmproj / draft model.
+    """
+    by_layer = model.weight_breakdown()["layer"]
+    kv = kv_layer_bytes(model.metadata, n_ctx, config)
+    compute = overhead_bytes(model, n_ctx, config)
+    loads, start = [], 0
+    for i, ((name, budget), count) in enumerate(zip(nodes, counts)):
+        layers = range(start, start + count)
+        weights = sum(by_layer.get(il, 0) for il in layers)
+        extra = 0
+        if i == len(nodes) - 1:
+            weights += by_layer.get(None, 0)
+            extra = companion_bytes(n_ctx, config)
+        loads.append(NodeLoad(name, count, weights, sum(kv[il] for il in layers), compute + extra, budget))
+        start += count
+    return loads
+
+def plan_tensor_split(model: ModelInfo, nodes: List[Tuple[str, int]], n_ctx: int, config: RunConfig) -> List[NodeLoad]:
+    """Contiguous layer counts per node (llama.cpp device order) minimising the fullest node's budget share.
+
+    For a given share r, filling each node in turn with as many layers as fit
+    in r of its budget is optimal, so r is found by bisection.
+    """
+    n_layers = hparam(model.metadata, "block_count")
+    by_layer = model.weight_breakdown()["layer"]
+    kv = kv_layer_bytes(model.metadata, n_ctx, config)
+    layer_bytes = [by_layer.get(il, 0) + kv[il] for il in range(n_layers)]
+    fixed = [overhead_bytes(model, n_ctx, config)] * len(nodes)
+    fixed[-1] += by_layer.get(None, 0) + companion_bytes(n_ctx, config)
+
+    def fill(ratio: float) -> Optional[List[int]]:
+        counts, start = [], 0
+        for i, (_, budget) in enumerate(nodes[:-1]):
+            used, end = fixed[i], start
+            while end < n_layers and used + layer_bytes[end] <= ratio * budget:
+                used += layer_bytes[end]
+                end += 1
+            counts.append(end - start)
+            start = end
+        last_used = fixed[-1] + sum(layer_bytes[start:])
+        return counts + [n_layers - start] if last_used <= ratio * nodes[-1][1] else None
+
+    lo, hi = 0.0, 1.0
+    while not fill(hi): hi *= 2
+    for _ in range(30):
+        mid = (lo + hi) / 2
+        if fill(mid): hi = mid
+        else: lo = mid
+    return split_loads(model, nodes, fill(hi), n_ctx, config)
+
+def parse_size(text: str) -> int:
+    """Parses '120GiB', '96G', '122880MiB', '4096B' or a bare number of GiB into bytes."""
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMGT]?)(i?B)?\s*", text, re.IGNORECASE)
+    if not match: raise ValueError(f"Invalid size: {text!r}")
+    unit = match.group(2).upper() or ("B" if match.group(3) else "G")
+    return int(float(match.group(1)) * 1024 ** "BKMGT".index(unit))
+
+def _read_first(paths: List[str]) -> Optional[str]:
+    for path in paths:
+        try:
+            with open(path) as f:
+                return f.read().strip()
+        except OSError:
+            continue
+    return None
+
+def detect_memory_budget() -> Tuple[int, str]:
+    """GPU-addressable memory on this machine: dedicated VRAM plus the GTT limit.
+
+    GTT comes from amdgpu's sysfs counters, else `amdgpu.gttsize` on the kernel
+    command line, and is capped by the TTM page limit (sysfs or `ttm.pages_limit`).
+    """
+    cmdline = _read_first(["/proc/cmdline"]) or ""
+    params = dict(re.findall(r"(\S+?)=(\S+)", cmdline))
+    sources = []
+
+    vram = sum(int(_read_first([p]) or 0) for p in glob.glob("/sys/class/drm/card*/device/mem_info_vram_total"))
+    gtt = sum(int(_read_first([p]) or 0) for p in glob.glob("/sys/class/drm/card*/device/mem_info_gtt_total"))
+    if gtt: sources.append("sysfs mem_info_gtt_total")
+    elif "amdgpu.gttsize" in params:
+        gtt = int(params["amdgpu.gttsize"]) * 1024**2
+        sources.append("amdgpu.gttsize")
+    pages_limit = _read_first(["/sys/module/ttm/parameters/pages_limit"]) or params.get("ttm.pages_limit")
+    if pages_limit and gtt:
+        gtt = min(gtt, int(pages_limit) * 4096)
+        sources.append("ttm pages_limit")
+    if not gtt and not vram: raise ValueError("Could not detect GPU memory limits; pass --budget SIZE")
+    if vram: sources.append("VRAM")
+    return vram + gtt, " + ".join(sources)
+
+def parse_llama_log(path: str) -> Dict[str, Any]:
+    """Pulls the context settings and buffer sizes llama.cpp prints at load time out of a log.
+
+    Buffer sizes are summed over devices (ROCm0, CPU, RPC[...]) and returned in bytes;
+    a "KV self size" total is only used when the log has no per-device KV lines.
+    Only the first model load and context are read: verbose llama-bench logs
+    repeat the KV / compute lines for every test.
+    """
+    with open(path, errors="replace") as f:
+        text = f.read()
+    result: Dict[str, Any] = {}
+    keys = list(LOG_BUFFER_PATTERNS)
+    last_phase = 0
+    for line in text.splitlines():
+        for phase, key in enumerate(keys):
+            match = re.search(LOG_BUFFER_PATTERNS[key], line)
+            if match: break
+        else:
+            continue
+        # A model line after KV / compute lines (or KV after compute) starts the next load.
+        if phase < last_phase: break
+        last_phase = phase
+        if LOG_KV_TOTAL in line: key = "kv_total_bytes"
+        result[key] = result.get(key, 0) + int(float(match.group(1)) * 1024 * 1024)
+    kv_total = result.pop("kv_total_bytes", None)
+    if kv_total is not None: result.setdefault("kv_bytes", kv_total)
+    for key, pattern in LOG_SETTING_PATTERNS.items():
+        match = re.search(pattern, text)
+        if match: result[key] = match.group(1)
+    for key in ("n_ctx", "n_batch", "n_ubatch", "n_seq_max"):
+        if key in result: result[key] = int(result[key])
+    if "flash_attn" in result: result["flash_attn"] = result["flash_attn"].lower() in ("1", "true", "enabled", "on", "auto")
+    if "kv_unified" in result: result["kv_unified"] = result["kv_unified"].lower() in ("1", "true")
+    return result
+
+def log_run_config(log: Dict[str, Any], config: RunConfig) -> RunConfig:
+    """config with the batch, slot, flash-attention and KV type settings found by parse_llama_log()."""
+    overrides = {k: log[k] for k in ("n_batch", "n_ubatch", "flash_attn", "kv_unified") if k in log}
+    if "n_seq_max" in log: overrides["n_parallel"] = log["n_seq_max"]
+    if "type_k" in log: overrides["cache_type_k"] = log["type_k"]
+    if "type_v" in log: overrides["cache_type_v"] = log["type_v"]
+    return replace(config, compute_scale=1.0, **overrides)
+
+def calibrate_compute_buffer(model: ModelInfo, log_paths: List[str], config: RunConfig) -> List[Dict[str, Any]]:
+    """Compares the compute-buffer estimate with what llama.cpp reported in each log."""
+    rows = []
+    for path in log_paths:
+        log = parse_llama_log(path)
+        if "compute_bytes" not in log or "n_ctx" not in log:
+            rows.append({"path": path, "error": "no 'compute buffer size' / n_ctx lines found"})
+            continue
+        estimate = compute_buffer_bytes(model, log["n_ctx"], log_run_config(log, config))
+        rows.append({"path": path, "n_ctx": log["n_ctx"], "measured": log["compute_bytes"], "estimate": estimate,
+                     "ratio": log["compute_bytes"] / estimate if estimate else 0.0})
+    return rows
+
+def describe_layers(metadata: Dict[str, Any]) -> str:
+    plan = layer_plan(metadata)
+    n_attn = sum(1 for layer in plan if layer.n_embd_k or layer.n_embd_v)
+    n_swa = sum(1 for layer in plan if layer.swa and (layer.n_embd_k or layer.n_embd_v))
+    n_recurrent = sum(1 for layer in plan if layer.n_embd_r or layer.n_embd_s)
+    text = f"{n_attn} attention"
+    if hparam(metadata, "attention.kv_lora_rank", 0): text += " (MLA)"
+    if n_swa: text += f", {n_swa} of them sliding-window ({swa_window(metadata):,} tokens)"
+    if n_recurrent: text += f", {n_recurrent} recurrent"
+    return text
+
+def describe_companion(companion: Companion, config: RunConfig) -> str:
+    name = os.path.basename(companion.model.path)
+    weights = format_mem(companion.model.weight_bytes).strip()
+    if companion.role == "mmproj":
+        return f"Projector: {name}, {weights} + {format_mem(encoder_compute_bytes(companion.model, config)).strip()} encoder compute buffer"
+    n_ctx_draft = f"-cd {config.n_ctx_draft:,}" if config.n_ctx_draft else "the slot context"
+    return (f"Draft Model: {name}, {weights} + KV ({config.cache_type_k_draft} / {config.cache_type_v_draft}) and compute"
+            f" at {n_ctx_draft} for each of {config.n_parallel} slot(s)")
+
+def describe_overhead(config: RunConfig) -> str:
+    if config.overhead_bytes is not None:
+        return f"{format_mem(config.overhead_bytes).strip()} flat (--overhead)"
+    scale = f", calibrated x{config.compute_scale:.2f}" if config.compute_scale != 1.0 else ""
+    return (f"compute buffer for -b {config.n_batch} -ub {config.n_ubatch} -fa {int(config.flash_attn)}{scale}"
+            f" + {format_mem(RUNTIME_RESERVE_BYTES).strip()} runtime reserve")
+
+def kv_type_pairs(config: RunConfig) -> List[Tuple[str, str]]:
+    pairs = [(t, t) for t in KV_COMPARE_TYPES]
+    if (config.cache_type_k, config.cache_type_v) not in pairs: pairs.append((config.cache_type_k, config.cache_type_v))
+    return pairs
+
+def print_kv_type_comparison(model: ModelInfo, n_ctx: int, config: RunConfig):
+    print(f"\n--- KV Cache Types at {n_ctx:,} tokens ---")
+    print(f"{'K / V':>15s} | {'Context Memory':>15s} | {'Est. Total VRAM':>15s}")
+    print("-" * 51)
+    for type_k, type_v in kv_type_pairs(config):
+        pair_config = replace(config, cache_type_k=type_k, cache_type_v=type_v)
+        kv_bytes = kv_cache_bytes(model.metadata, n_ctx, pair_config)
+        marker = "*" if (type_k, type_v) == (config.cache_type_k, config.cache_type_v) else " "
+        print(f"{marker}{type_k + ' / ' + type_v:>14s} | {format_mem(kv_bytes):>15s} | {format_mem(total_bytes(model, n_ctx, pair_config)):>15s}")
+
+def print_context_solver(model: ModelInfo, budget_bytes: int, budget_source: str, config: RunConfig):
+    """Largest -c per KV cache type (rows) and parallel slot count (columns)."""
+    slots = sorted(set(SOLVER_SLOTS) | {config.n_parallel})
+    print(f"\n--- Max Context (-c) within {format_mem(budget_bytes).strip()} ({budget_source}) ---")
+    header = f"{'K / V':>15s}" + "".join(f" | {'-np ' + str(n):>10s}" for n in slots)
+    print(header)
+    print("-" * len(header))
+    for type_k, type_v in kv_type_pairs(config):
+        marker = "*" if (type_k, type_v) == (config.cache_type_k, config.cache_type_v) else " "
+        line = f"{marker}{type_k + ' / ' + type_v:>14s}"
+        for n in slots:
+            line += f" | {max_context_for_budget(model, budget_bytes, replace(config, cache_type_k=type_k, cache_type_v=type_v, n_parallel=n)):>10,}"
+        print(line)
+    if config.kv_unified: print("With --kv-unified the -np slots share all -c tokens of context.")
+    else: print("Each of the -np slots gets -c / np tokens of context.")
+
+def print_session_capacity(contexts: List["ContextEstimate"], budget_bytes: int, budget_source: str, config: RunConfig):
+    """Most concurrent sessions per session context, with the -np / -c to serve them."""
+    print(f"\n--- Concurrent Sessions within {format_mem(budget_bytes).strip()} ({budget_source}) ---")
+    print(f"{'Session Context':>15s} | {'Max Sessions':>12s} | {'llama-server':>24s}")
+    print("-" * 58)
+    for ctx in contexts:
+        flags = f"-np {ctx.max_sessions} -c {ctx.max_sessions * ctx.n_ctx}" + (" --kv-unified" if config.kv_unified else "")
+        print(f"{ctx.n_ctx:>15,} | {ctx.max_sessions:>12,} | {flags if ctx.max_sessions else '-':>24s}")
+
+def print_expert_offload(model: ModelInfo, budget_bytes: int, budget_source: str, n_ctx: int, config: RunConfig):
+    groups = expert_groups(model)
+    if not groups: return
+    print(f"\n--- Expert Offload at {n_ctx:,} tokens within {format_mem(budget_bytes).strip()} ({budget_source}) ---")
+    plans = plan_expert_offload(model, budget_bytes, n_ctx, config)
+    if not plans:
+        need = total_bytes(model, n_ctx, config) - sum(groups.values())
+        print(f"Does not fit even with all experts on CPU (needs {format_mem(need).strip()} on the GPU); lower -c or use a smaller KV type.")
+        return
+    print(f"{'Placement':>34s} | {'GPU':>11s} | {'CPU':>11s} | {'CPU read/token':>14s}")
+    print("-" * 79)
+    for plan in plans:
+        print(f"{plan.name:>34s} | {format_mem(plan.gpu_bytes):>11s} | {format_mem(plan.cpu_bytes):>11s} | {format_mem(plan.cpu_bytes_per_token):>14s}")
+    best = plans[0]
+    if best.flags: print(f"Best: {' '.join(best.flags)}")
+    else: print("Best: no offload needed.")
+
+def tensor_split_arg(loads: List[NodeLoad]) -> str:
+    """--tensor-split value for the loads; the output layer counts towards the last device."""
+    return ",".join(str(load.layers + (i == len(loads) - 1)) for i, load in enumerate(loads))
+
+def print_tensor_split(loads: List[NodeLoad], n_ctx: int):
+    print(f"\n--- Layer Split at {n_ctx:,} tokens ---")
+    print(f"{'Node':>20s} | {'Layers':>6s} | {'Weights':>11s} | {'KV Cache':>11s} | {'Overhead':>11s} | {'Total':>11s} | {'Budget':>11s}")
+    print("-" * 101)
+    for load in loads:
+        print(f"{load.name[-20:]:>20s} | {load.layers:>6,} | {format_mem(load.weight_bytes):>11s} | {format_mem(load.kv_bytes):>11s} | "
+              f"{format_mem(load.compute_bytes):>11s} | {format_mem(load.total_bytes):>11s} | {format_mem(load.budget_bytes):>11s}")
+    print(f"Use: --tensor-split {tensor_split_arg(loads)} (devices in llama.cpp order: --rpc hosts first, local last)")
+    for load in loads:
+        if load.total_bytes > load.budget_bytes:
+            print(f"Warning: {load.name} needs {format_mem(load.total_bytes - load.budget_bytes).strip()} more than its budget.")
+
+def print_quant_what_if(model: ModelInfo, scenarios: List[str], n_ctx: int, config: RunConfig, budget: Optional[Tuple[int, str]]):
+    """Weights, total at n_ctx and (with a budget) max context for each requantization scenario."""
+    variants = [("as downloaded", model)] + [(scenario, requantize(model, parse_quant_rules(scenario))) for scenario in scenarios]
+    print(f"\n--- Quantization What-If at {n_ctx:,} tokens" + (f", budget {format_mem(budget[0]).strip()} ({budget[1]}) ---" if budget else " ---"))
+    header = f"{'Scenario':>40s} | {'Weights':>11s} | {'Est. Total VRAM':>15s}" + (f" | {'Max Context':>11s}" if budget else "")
+    print(header)
+    print("-" * len(header))
+    for label, variant in variants:
+        line = f"{label[-40:]:>40s} | {format_mem(variant.weight_bytes):>11s} | {format_mem(total_bytes(variant, n_ctx, config)):>15s}"
+        if budget: line += f" | {max_context_for_budget(variant, budget[0], config):>11,}"
+        print(line)
+
+def print_calibration(rows: List[Dict[str, Any]]):
+    print("\n--- Compute Buffer Calibration ---")
+    print(f"{'Log':>30s} | {'Context':>9s} | {'Measured':>11s} | {'Estimate':>11s} | {'Ratio':>6s}")
+    for row in rows:
+        label = os.path.basename(row["path"])[-30:]
+        if "error" in row:
+            print(f"{label:>30s} | {row['error']}")
+            continue
+        print(f"{label:>30s} | {row['n_ctx']:>9,} | {format_mem(row['measured']):>11s} | {format_mem(row['estimate']):>11s} | {row['ratio']:6.2f}")
+
+# Errors estimate() raises for unreadable or unsupported models.
+ESTIMATE_ERRORS = (OSError, ValueError, struct.error, NotImplementedError, KeyError)
+
+@dataclass
+class ContextEstimate:
+    n_ctx: int
+    kv_bytes: int
+    overhead_bytes: int
+    total_bytes: int
+    # --mmproj / -md weights and buffers, included in total_bytes.
+    companion_bytes: int = 0
+    # -np slots of n_ctx tokens each that fit the budget passed to estimate(), else None.
+    max_sessions: Optional[int] = None
+
+@dataclass
+class Estimate:
+    """Result of estimate(): one model under one RunConfig."""
+    path: str
+    name: str
+    architecture: str
+    context_length: int
+    weight_bytes: int
+    n_tensors: int
+    n_shards: int
+    config: RunConfig
+    contexts: List[ContextEstimate] = field(default_factory=list)
+    # Largest -c within the budget passed to estimate(), else None.
+    max_context: Optional[int] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        row = asdict(replace(self, config=replace(self.config, companions=())))
+        row["config"]["companions"] = [{"role": c.role, "path": c.model.path, "weight_bytes": c.model.weight_bytes}
+                                       for c in self.config.companions]
+        return row
+
+CSV_FIELDS = ["path", "name", "architecture", "weight_bytes", "cache_type_k", "cache_type_v",
+              "n_ctx", "kv_bytes", "overhead_bytes", "companion_bytes", "total_bytes", "max_context", "max_sessions", "error"]
+
+def estimate(gguf_file: str, context_sizes: Optional[List[int]] = None, config: Optional[RunConfig] = None,
+             budget_bytes: Optional[int] = None, cache: Optional[ModelCache] = None,
+             include_training_context: bool = False, model: Optional[ModelInfo] = None) -> Estimate:
+    """Estimates gguf_file at each context size up to the training context.
+
+    Raises one of ESTIMATE_ERRORS if the model cannot be read. Pass `model`
+    to reuse an already loaded ModelInfo.
+    """
+    config = config or RunConfig()
+    model = model or load_model_info(gguf_file, cache)
+    metadata = model.metadata
+    if not metadata.get("general.architecture"): raise KeyError("Could not read 'general.architecture' from model metadata.")
+    max_context = training_context(metadata)
+    contexts = {n_ctx for n_ctx in (context_sizes or DEFAULT_CONTEXTS) if not max_context or n_ctx <= max_context}
+    if include_training_context and max_context: contexts.add(max_context)
+    result = Estimate(gguf_file, metadata.get("general.name") or os.path.basename(gguf_file),
+                      metadata["general.architecture"], max_context, model.weight_bytes,
+                      len(model.tensors), len(model.shards), config)
+    for n_ctx in sorted(contexts):
+        kv_bytes, other_bytes = kv_cache_bytes(metadata, n_ctx, config), overhead_bytes(model, n_ctx, config)
+        extra_bytes = companion_bytes(n_ctx, config)
+        sessions = max_sessions_for_budget(model, budget_bytes, n_ctx, config) if budget_bytes else None
+        result.contexts.append(ContextEstimate(n_ctx, kv_bytes, other_bytes, model.weight_bytes + kv_bytes + other_bytes + extra_bytes,
+                                               extra_bytes, sessions))
+    if budget_bytes: result.max_context = max_context_for_budget(model, budget_bytes, config)
+    return result
+
+def csv_rows(row: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Flattens an Estimate.to_dict() (or a scan error row) into one CSV row per context."""
+    if "error" in row: return [row]
+    base = {key: row[key] for key in ("path", "name", "architecture", "weight_bytes", "max_context")}
+    base.update(cache_type_k=row["config"]["cache_type_k"], cache_type_v=row["config"]["cache_type_v"])
+    return [dict(base, **ctx) for ctx in row["contexts"]]
+
+def write_csv(rows: List[Dict[str, Any]]):
+    import csv
+    writer = csv.DictWriter(sys.stdout, fieldnames=CSV_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    for row in rows: writer.writerows(csv_rows(row))
+
+def run_estimator(gguf_file: str, context_sizes: List[int], per_layer: bool = False,
+                  cache: Optional[ModelCache] = None, config: Optional[RunConfig] = None,
+                  budget: Optional[Tuple[int, str]] = None, calibration_logs: Optional[List[str]] = None,
+                  nodes: Optional[List[Tuple[str, int]]] = None, output_format: str = "table",
+                  what_if: Optional[List[str]] = None, extra_models: Optional[List[Tuple[str, str]]] = None):
+    """Prints the estimate for one model; `budget` is (bytes, description) as from resolve_budget(),
+    `nodes` the (name, bytes) devices from parse_nodes(), `extra_models` the (role, path) of --mmproj / -md."""
+    config = config or RunConfig()
     try:
-        reader = GGUFMetadataReader(gguf_file).read()
-        metadata = reader.metadata
-        prefix = metadata.get("general.architecture")
-        if not prefix: raise KeyError("Could not read 'general.architecture' from model metadata.")
-        
-        model_size_bytes = get_total_model_size_from_disk(gguf_file)
-        overhead_bytes = int(overhead_gib * 1024**3)
-
-        n_layers = metadata[f"{prefix}.block_count"]
-        n_head_kv = metadata[f"{prefix}.attention.head_count_kv"]
-        training_context = metadata.get(f"{prefix}.context_length", 0)
-        n_embd_head_k = metadata[f"{prefix}.attention.key_length"]
-        n_embd_head_v = metadata[f"{prefix}.attention.value_length"]
-        swa_window_size = metadata.get(f"{prefix}.attention.sliding_window_size", 0)
-        
-        is_scout_model = "scout" in metadata.get("general.name", "").lower()
-        if is_scout_model and swa_window_size == 0: n_layers_swa, n_layers_full, swa_window_size = 36, 12, 8192
-        elif swa_window_size > 0: n_layers_swa, n_layers_full = n_layers, 0
-        else: n_layers_swa, n_layers_full = 0, n_layers
+        model = load_model_info(gguf_file, cache)
+        metadata = model.metadata
+        if extra_models: config = replace(config, companions=load_companions(extra_models, cache))
+        if calibration_logs:
+            calibration = calibrate_compute_buffer(model, calibration_logs, config)
+            ratios = [row["ratio"] for row in calibration if row.get("ratio")]
+            if ratios: config = replace(config, compute_scale=sum(ratios) / len(ratios))
+        # The table adds a row at the training context; json / csv carry only the requested contexts.
+        result = estimate(gguf_file, context_sizes, config, budget[0] if budget else None,
+                          include_training_context=output_format == "table", model=model)
+        if output_format == "json":
+            print(json.dumps(result.to_dict(), indent=2))
+            return
+        if output_format == "csv":
+            write_csv([result.to_dict()])
+            return
+
+        max_context = result.context_length
+        plan_context = min(max(context_sizes), max_context) if max_context > 0 else max(context_sizes)
 
         print(f"\n--- Model '{metadata.get('general.name', 'N/A')}' ---")
-        if training_context > 0: print(f"Max Context: {training_context:,} tokens")
-        print(f"Model Size: {format_mem(model_size_bytes).strip()} (from file size)")
-        print(f"Incl. Overhead: {overhead_gib:.2f} GiB (for compute buffer, etc. adjustable via --overhead)")
-        
-        if training_context > 0:
-            context_sizes = sorted(list(set([c for c in context_sizes if c <= training_context] + [c for c in [training_context] if c not in context_sizes])))
-        else: context_sizes = sorted(context_sizes)
-        
-        bytes_per_token_per_layer = n_head_kv * (n_embd_head_k + n_embd_head_v) * 2
-        
+        if max_context > 0: print(f"Max Context: {max_context:,} tokens")
+        print(f"Model Size: {format_mem(result.weight_bytes).strip()} ({result.n_tensors:,} tensors in {result.n_shards} file(s))")
+        print(f"Overhead: {describe_overhead(config)}")
+        print(f"KV Cache Type: K={config.cache_type_k}, V={config.cache_type_v} (adjustable via -ctk / -ctv)")
+        if config.n_parallel > 1 or config.kv_unified:
+            print(f"Parallel Slots: {config.n_parallel}, " + ("one unified KV cache shared by all slots" if config.kv_unified else
+                  f"-c / {config.n_parallel} tokens of KV cache each (--kv-unified to share)"))
+        print(f"Layers: {describe_layers(metadata)}")
+        for companion in config.companions: print(describe_companion(companion, config))
+        print_weight_breakdown(model, per_layer)
+        if calibration_logs: print_calibration(calibration)
+
+        extra_column = f" | {'Extra Models':>15s}" if config.companions else ""
         print("\n--- Memory Footprint Estimation ---")
-        print(f"{'Context Size':>15s} | {'Context Memory':>15s} | {'Est. Total VRAM':>15s}")
-        print("-" * 51)
-        for n_ctx in context_sizes:
-            mem_full = n_ctx * n_layers_full * bytes_per_token_per_layer
-            mem_swa = min(n_ctx, swa_window_size) * n_layers_swa * bytes_per_token_per_layer
-            kv_cache_bytes = mem_full + mem_swa
-            total_bytes = model_size_bytes + kv_cache_bytes + overhead_bytes
-            print(f"{n_ctx:>15,} | {format_mem(kv_cache_bytes):>15s} | {format_mem(total_bytes):>15s}")
-            
-    except (FileNotFoundError, ValueError, struct.error, NotImplementedError, KeyError) as e:
+        print(f"{'Context Size':>15s} | {'Context Memory':>15s} | {'Overhead':>15s}{extra_column} | {'Est. Total VRAM':>15s}")
+        print("-" * (69 + len(extra_column)))
+        for ctx in result.contexts:
+            extra = f" | {format_mem(ctx.companion_bytes):>15s}" if config.companions else ""
+            print(f"{ctx.n_ctx:>15,} | {format_mem(ctx.kv_bytes):>15s} | {format_mem(ctx.overhead_bytes):>15s}{extra} | {format_mem(ctx.total_bytes):>15s}")
+        if result.contexts: print_kv_type_comparison(model, result.contexts[-1].n_ctx, config)
+        if what_if is not None: print_quant_what_if(model, what_if or list(QUANT_PRESETS), plan_context, config, budget)
+        if budget:
+            print_context_solver(model, budget[0], budget[1], config)
+            print_session_capacity(result.contexts, budget[0], budget[1], config)
+            print_expert_offload(model, budget[0], budget[1], plan_context, config)
+        if nodes: print_tensor_split(plan_tensor_split(model, nodes, plan_context, config), plan_context)
+
+    except BrokenPipeError:
+        raise
+    except ESTIMATE_ERRORS as e:
         print(f"\nError: {e}", file=sys.stderr)
         sys.exit(1)
 
+def find_models(root: str) -> List[str]:
+    """One .gguf per model below root, picked like benchmark/run_benchmarks.sh does:
+    single-file models or the first shard, never multimodal projectors."""
+    models = []
+    for dirpath, _, filenames in os.walk(root, followlinks=True):
+        for name in filenames:
+            if not name.endswith(".gguf") or "mmproj" in name.lower(): continue
+            if re.search(r"-000\d*-of-", name) and not re.search(r"-00001-of-", name): continue
+            models.append(os.path.join(dirpath, name))
+    return sorted(models)
+
+def scan_models(root: str, context_sizes: List[int], budget_bytes: Optional[int],
+                cache: Optional[ModelCache] = None, config: Optional[RunConfig] = None,
+                workers: int = 16) -> List[Dict[str, Any]]:
+    """Parses every model below root in a thread pool and estimates each one."""
+
+    def estimate_one(path: str) -> Dict[str, Any]:
+        try:
+            return estimate(path, context_sizes, config, budget_bytes, cache).to_dict()
+        except ESTIMATE_ERRORS as e:
+            return {"path": path, "error": str(e)}
+
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(estimate_one, find_models(root)))
+
+def print_scan(rows: List[Dict[str, Any]], context_sizes: List[int], config: RunConfig, budget: Optional[Tuple[int, str]]):
+    header = f"{'Model':<44s} | {'Weights':>11s}" + "".join(f" | {'KV@' + str(c):>11s}" for c in context_sizes)
+    if budget: header += f" | {'Max Context':>11s}"
+    print(f"\n--- {len(rows)} model(s), overhead: {describe_overhead(config)}" + (f", budget {format_mem(budget[0]).strip()} ({budget[1]}) ---" if budget else " ---"))
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        label = os.path.basename(row["path"])
+        label = label if len(label) <= 44 else label[:41] + "..."
+        if "error" in row:
+            print(f"{label:<44s} | error: {row['error']}")
+            continue
+        kv = {ctx["n_ctx"]: ctx["kv_bytes"] for ctx in row["contexts"]}
+        line = f"{label:<44s} | {format_mem(row['weight_bytes']):>11s}"
+        line += "".join(f" | {format_mem(kv[c]) if c in kv else '-':>11s}" for c in context_sizes)
+        if budget: line += f" | {row['max_context']:>11,}"
+        print(line)
+
+def check_models(paths: List[str]) -> bool:
+    """Reads and verifies every shard of each model (no cache); prints one line per model."""
+    ok = True
+    for path in paths:
+        try:
+            model = load_model_info(path)
+            print(f"OK     {path} ({len(model.shards)} file(s), {len(model.tensors):,} tensors, {format_mem(model.weight_bytes).strip()})")
+        except BrokenPipeError:
+            raise
+        except ESTIMATE_ERRORS as e:
+            print(f"FAILED {path}: {e}")
+            ok = False
+    return ok
+
+def resolve_budget(text: Optional[str]) -> Optional[Tuple[int, str]]:
+    """Turns the --budget argument into (bytes, description)."""
+    if not text: return None
+    if text.lower() == "auto": return detect_memory_budget()
+    return parse_size(text), "--budget"
+
+def parse_nodes(items: Optional[List[str]]) -> Optional[List[Tuple[str, int]]]:
+    """Turns --nodes NAME=SIZE arguments into (name, bytes) pairs."""
+    if not items: return None
+    nodes = []
+    for i, item in enumerate(items):
+        name, _, size = item.rpartition("=")
+        budget = parse_size(size)
+        if budget <= 0: raise ValueError(f"Node budget must be positive: {item!r}")
+        nodes.append((name or f"node{i}", budget))
+    return nodes
+
 def main():
+    import argparse
     parser = argparse.ArgumentParser(
         description="Calculate VRAM requirements for a GGUF model, including a configurable overhead for compute buffers.",
         formatter_class=argparse.RawTextHelpFormatter
     )
-    parser.add_argument("gguf_file", help="Path to the GGUF model file (any part of a multi-part model).")
-    parser.add_argument("-c", "--contexts", nargs='+', type=int, default=[4096, 8192, 16384, 32768, 65536, 131072, 262144, 524288, 1048576], help="Space-separated list of context sizes to calculate.")
-    parser.add_argument("--overhead", type=float, default=2.0, help="Estimated overhead in GiB for compute buffers, drivers, etc. (default: 2.0)")
+    parser.add_argument("gguf_file", nargs="?", help="Path or http(s):// URL of the GGUF model file (any part of a multi-part model).")
+    parser.add_argument("--scan", metavar="DIR", help="Estimate every model below DIR (first shard or single file, no mmproj) in parallel.")
+    parser.add_argument("-c", "--contexts", nargs='+', type=int, default=None, help="Space-separated list of context sizes to calculate.")
+    parser.add_argument("--overhead", type=float, default=None, help="Flat overhead in GiB for compute buffers, drivers, etc.\n(default: derived from the model, -b/-ub and -fa)")
+    parser.add_argument("-b", "--batch-size", type=int, default=2048, help="Logical batch size, as passed to llama.cpp (default: 2048).")
+    parser.add_argument("-ub", "--ubatch-size", type=int, default=512, help="Physical batch size, as passed to llama.cpp (default: 512).")
+    parser.add_argument("-fa", "--flash-attn", type=int, choices=[0, 1], default=1, help="Flash attention on/off, as passed to llama.cpp (default: 1).")
+    parser.add_argument("--calibrate-log", nargs="+", metavar="LOG", help="llama.cpp logs of this model; scales the compute-buffer estimate to their 'compute buffer size' lines.")
+    parser.add_argument("--budget", default=None, help="Memory budget, e.g. 120GiB or 96G (bare numbers are GiB), or 'auto' to read\nthe GTT/TTM limits from sysfs and /proc/cmdline. Solves for the largest -c that fits.")
+    parser.add_argument("--nodes", nargs="+", metavar="NAME=SIZE", help="Memory of each llama.cpp device for a multi-node RPC run, in device order\n(--rpc hosts first, the local machine last), e.g. 192.168.100.11=110GiB local=100GiB.\nPlans a --tensor-split at the largest -c.")
+    parser.add_argument("-np", "--parallel", type=int, default=1, help="Parallel sequences (llama-server -np) (default: 1). Each gets -c / np tokens of KV cache.")
+    parser.add_argument("-kvu", "--kv-unified", action="store_true", help="One KV cache shared by all -np slots (llama-server --kv-unified).")
+    parser.add_argument("-mm", "--mmproj", metavar="FILE", help="Multimodal projector loaded with the model (llama-server --mmproj).")
+    parser.add_argument("-md", "--model-draft", metavar="FILE", help="Draft model for speculative decoding (llama-server -md); llama-server gives\nit its own context per slot.")
+    parser.add_argument("-cd", "--ctx-size-draft", type=int, default=None, help="Draft context size (default: the slot context, -c / np).")
+    parser.add_argument("-ctkd", "--cache-type-k-draft", choices=KV_CACHE_TYPES, default="f16", help="Draft KV cache type for K (default: f16).")
+    parser.add_argument("-ctvd", "--cache-type-v-draft", choices=KV_CACHE_TYPES, default="f16", help="Draft KV cache type for V (default: f16).")
+    parser.add_argument("-ctk", "--cache-type-k", choices=KV_CACHE_TYPES, default="f16", help="KV cache type for K, as passed to llama.cpp (default: f16).")
+    parser.add_argument("-ctv", "--cache-type-v", choices=KV_CACHE_TYPES, default="f16", help="KV cache type for V, as passed to llama.cpp (default: f16).")
+    parser.add_argument("--format", choices=["table", "json", "csv"], default="table", help="Output format; json and csv print only the estimate\n(one CSV row per model and context) (default: table).")
+    parser.add_argument("--check", action="store_true", help="Only verify that every shard is present, complete and consistent;\nexits 1 if any model fails (works with --scan).")
+    parser.add_argument("--what-if", nargs="*", metavar="SCENARIO", help=f"Size the model at other quant types: presets ({', '.join(QUANT_PRESETS)}; all of them\nif none given) or rules like 'attn=Q8_0,experts=Q4_K' (keys: tensor class, name substring or *).")
+    parser.add_argument("--per-layer", action="store_true", help="Also list weight bytes for every layer.")
+    parser.add_argument("--no-cache", action="store_true", help=f"Always re-read the GGUF headers instead of using the metadata cache in {DEFAULT_CACHE_DIR}.")
     args = parser.parse_args()
-    run_estimator(args.gguf_file, args.contexts, args.overhead)
+    if bool(args.gguf_file) == bool(args.scan): parser.error("pass either a GGUF file or --scan DIR")
+    extra_models = [(role, path) for role, path in (("mmproj", args.mmproj), ("draft", args.model_draft)) if path]
+    if args.scan and extra_models: parser.error("--mmproj / -md apply to a single model, not --scan")
+    if args.parallel < 1: parser.error(f"-np must be at least 1, got {args.parallel}")
+    cache = None if args.no_cache else ModelCache()
+    config = RunConfig(cache_type_k=args.cache_type_k, cache_type_v=args.cache_type_v,
+                       n_batch=args.batch_size, n_ubatch=args.ubatch_size, flash_attn=bool(args.flash_attn),
+                       n_parallel=args.parallel, kv_unified=args.kv_unified, n_ctx_draft=args.ctx_size_draft,
+                       cache_type_k_draft=args.cache_type_k_draft, cache_type_v_draft=args.cache_type_v_draft,
+                       overhead_bytes=int(args.overhead * 1024**3) if args.overhead is not None else None)
+    try:
+        budget = resolve_budget(args.budget)
+        nodes = parse_nodes(args.nodes)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.check:
+        sys.exit(0 if check_models(find_models(args.scan) if args.scan else [args.gguf_file]) else 1)
+    if args.scan:
+        context_sizes = sorted(args.contexts or DEFAULT_SCAN_CONTEXTS)
+        rows = scan_models(args.scan, context_sizes, budget[0] if budget else None, cache, config)
+        if args.format == "json":
+            print(json.dumps({"overhead": describe_overhead(config),
+                              "budget_bytes": budget[0] if budget else None,
+                              "models": rows}, indent=2))
+        elif args.format == "csv":
+            write_csv(rows)
+        else:
+            print_scan(rows, context_sizes, config, budget)
+        return
+    run_estimator(args.gguf_file, args.contexts or DEFAULT_CONTEXTS, args.per_layer, cache, config, budget, args.calibrate_log, nodes, args.format, args.what_if, extra_models)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        main()
+    except BrokenPipeError:
+        # The reader went away (e.g. `--format csv | head`): stop quietly, and point stdout at
+        # /dev/null so the interpreter's final flush does not raise again.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())